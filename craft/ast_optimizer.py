@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType, RELATIONAL_OPERATORS
+from play_with_compiler.craft.simple_calculator import SimpleASTNode
+
+# 二元运算的节点类型，它们的操作数在求值时都会被int()取整
+_BINARY_TYPES = (ASTNodeType.Additive, ASTNodeType.Multiplicative, ASTNodeType.Relational)
+
+'''
+AST优化：常量折叠和代数化简。位于SimpleParser.parse和求值之间。
+ * 子节点都是IntLiteral的Additive、Multiplicative、Relational节点，直接算出结果，换成一个IntLiteral；
+ * x+0、0+x、x-0、x*1、1*x 化简成 x；
+ * x*0、0*x 化简成 0，但只在x求值时不可能出错（不含变量和除法）时才做。
+
+优化的结果与SimpleScript.evaluate的求值结果完全一致：
+evaluate里除法得到的是浮点数，只有作为另一个运算的操作数时才会被int()取整，
+所以除法只在它是操作数时才折叠；化简掉x*1时，如果x是除法，也要求它是操作数。
+除数为0的除法不折叠，留到运行时报错。
+
+优化不修改原来的AST（它可能来自ParseCache，被多处共享），而是返回一棵新的树。
+用显式的栈做后序遍历，不递归。
+'''
+class ASTOptimizer(object):
+    def __init__(self):
+        self.nodes_before = 0
+        self.nodes_after = 0
+
+    '''
+    被优化掉的节点数
+    '''
+    def removed(self):
+        return self.nodes_before - self.nodes_after
+
+    def optimize(self, root):
+        results = []              # 已经优化好的子树：(新节点, 常量值或None, 求值是否不会出错, 节点数)
+        stack = [[root, 0, False]] # [节点, 下一个要处理的子节点的下标, 是否是二元运算的操作数]
+        while stack:
+            frame = stack[-1]
+            node, index, is_operand = frame
+            children = node.get_children()
+            if index < len(children):
+                frame[1] = index + 1
+                is_binary = node.get_type() in _BINARY_TYPES
+                stack.append([children[index], 0, is_binary])
+                continue
+            stack.pop()
+
+            self.nodes_before += 1
+            operands = results[len(results) - len(children):]
+            del results[len(results) - len(children):]
+            if len(operands) == 2 and node.get_type() in _BINARY_TYPES:
+                results.append(self.fold(node, operands[0], operands[1], is_operand))
+            else:
+                results.append(self.copy(node, operands))
+
+        tree, value, safe, count = results[0]
+        self.nodes_after += count
+        return tree
+
+    # 复制节点，子节点换成优化后的子树
+    def copy(self, node, operands):
+        new_node = SimpleASTNode(node.get_type(), node.get_text())
+        count = 1
+        safe = node.get_type() != ASTNodeType.Identifier
+        for child, value, child_safe, child_count in operands:
+            new_node.add_child(child)
+            count += child_count
+            safe = safe and child_safe
+        value = int(node.get_text()) if node.get_type() == ASTNodeType.IntLiteral else None
+        return (new_node, value, safe, count)
+
+    # 用一个整数生成IntLiteral
+    def literal(self, value):
+        return (SimpleASTNode(ASTNodeType.IntLiteral, str(value)), value, True, 1)
+
+    def fold(self, node, left, right, is_operand):
+        op = node.get_text()
+        is_additive = node.get_type() == ASTNodeType.Additive
+        a = left[1]
+        b = right[1]
+
+        if node.get_type() == ASTNodeType.Relational:
+            if a != None and b != None:
+                return self.literal(RELATIONAL_OPERATORS[op](a, b))
+            return self.copy(node, [left, right])
+
+        if a != None and b != None:
+            if is_additive:
+                return self.literal(a + b if op == '+' else a - b)
+            if op == '*':
+                return self.literal(a * b)
+            if b != 0 and is_operand:
+                return self.literal(int(a / b))
+
+        # 代数化简：x+0、0+x、x-0、x*1、1*x
+        kept = None
+        if is_additive:
+            if b == 0:
+                kept = left
+            elif a == 0 and op == '+':
+                kept = right
+        elif op == '*':
+            if b == 1:
+                kept = left
+            elif a == 1:
+                kept = right
+            elif (b == 0 and left[2]) or (a == 0 and right[2]):
+                return self.literal(0)
+        if kept != None and (is_operand or not self.is_division(kept[0])):
+            return kept
+
+        result = self.copy(node, [left, right])
+        if op != '*' and not is_additive:
+            return (result[0], None, False, result[3]) # 除法可能除以0
+        return result
+
+    def is_division(self, node):
+        return node.get_type() == ASTNodeType.Multiplicative and node.get_text() != '*'
@@ -40,6 +40,8 @@ class TokenType(Enum):
 只有类型和文本值两个属性。
 '''
 class Token(object):
+    __slots__ = ()  # 让子类可以完全使用__slots__，不带__dict__
+
     def get_type(self):  # Token的类型
         pass
     def get_text(self):     # Token的文本值
@@ -62,11 +64,26 @@ class ASTNodeType(Enum):
     Identifier = 7        # 标识符
     IntLiteral = 8        # 整型字面量
 
+    Relational = 9        # 关系表达式（比较）
+
+'''
+关系运算的运算符。和C语言一样，结果是整数：成立时是1，否则是0。
+'''
+RELATIONAL_OPERATORS = {
+    '>=': lambda a, b: int(a >= b),
+    '>': lambda a, b: int(a > b),
+    '==': lambda a, b: int(a == b),
+    '<=': lambda a, b: int(a <= b),
+    '<': lambda a, b: int(a < b),
+}
+
 '''
 AST的节点。
 属性包括AST的类型、文本值、下级子节点和父节点
 '''
 class ASTNode(object):
+    __slots__ = ()
+
     def get_parent(self):    # 父节点
         pass
     def get_children(self):  # 子节点
@@ -108,4 +125,11 @@ class TokenReader(object):
     设置Token流当前的读取位置
     '''
     def set_position(self, position):
+        pass
+
+    '''
+    告诉Token流，当前位置之前的Token不会再被回溯访问了，可以丢弃。
+    基于列表的实现可以忽略这个调用。
+    '''
+    def release(self):
         pass
\ No newline at end of file
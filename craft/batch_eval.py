@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType, RELATIONAL_OPERATORS
+from array import array
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# NumPy数组的比较得到布尔数组，再转换成整数
+_NUMPY_COMPARISONS = {
+    '>=': operator.ge,
+    '>': operator.gt,
+    '==': operator.eq,
+    '<=': operator.le,
+    '<': operator.lt,
+}
+
+'''
+批量求值：同一段脚本在很多组变量取值上求值。
+脚本中没有声明的变量（自由变量）由调用者按列给出，每列是一个NumPy数组，或者没有NumPy时的array('q')；
+每个Additive、Multiplicative、Relational节点只求值一次，一次算出整列的结果。
+返回每个声明过的变量的结果列。
+
+用法：
+    tree = SimpleParser().parse('int total = price * qty - discount;')
+    result = BatchEvaluator().evaluate(tree, {'price': ..., 'qty': ..., 'discount': ...})
+    result['total']
+
+每一行的结果与SimpleScript.evaluate逐行求值相同：除法得到浮点数，作为操作数时向零取整，赋给变量时也取整。
+不同的是列中的整数是定长的64位整数，NumPy下溢出会回绕，array('q')下溢出会抛出OverflowError；
+大于2**53的整数做除法时，会先转换成浮点数再除，可能和Python的整数除法差一点精度。
+'''
+class BatchEvaluator(object):
+    '''
+    use_numpy为None时，有NumPy就用NumPy
+    '''
+    def __init__(self, use_numpy=None):
+        if use_numpy == None:
+            use_numpy = numpy != None
+        if use_numpy and numpy == None:
+            raise Exception('numpy is not installed')
+        self.use_numpy = use_numpy
+
+    def evaluate(self, tree, columns):
+        rows = None
+        env = {}
+        for name, column in columns.items():
+            if rows != None and len(column) != rows:
+                raise Exception('column ' + name + ' has ' + str(len(column)) + ' rows, expecting ' + str(rows))
+            rows = len(column)
+            env[name] = numpy.asarray(column, dtype=numpy.int64) if self.use_numpy else array('q', column)
+        if rows == None:
+            rows = 1
+
+        declared = []
+        statements = tree.get_children() if tree.get_type() == ASTNodeType.Programm else [tree]
+        for statement in statements:
+            node_type = statement.get_type()
+            if node_type == ASTNodeType.IntDeclaration or node_type == ASTNodeType.AssignmentStmt:
+                var_name = statement.get_text()
+                if node_type == ASTNodeType.AssignmentStmt and var_name not in env:
+                    raise Exception('unknown variable: ' + var_name)
+                value = None
+                if len(statement.get_children()) > 0:
+                    value = self.truncate(self.evaluate_expression(statement.get_children()[0], env))
+                env[var_name] = value
+                if var_name not in declared:
+                    declared.append(var_name)
+            else:
+                self.evaluate_expression(statement, env) # 表达式语句没有结果列，但出错时同样要报错
+
+        results = {}
+        for name in declared:
+            results[name] = self.broadcast(env[name], rows)
+        return results
+
+    '''
+    对一个表达式求值，结果是一个标量或者一整列。用显式的栈做后序遍历。
+    '''
+    def evaluate_expression(self, root, env):
+        values = []
+        stack = [[root, 0]]
+        while stack:
+            frame = stack[-1]
+            node, index = frame
+            node_type = node.get_type()
+            children = node.get_children()
+            if (node_type == ASTNodeType.Additive or node_type == ASTNodeType.Multiplicative
+                    or node_type == ASTNodeType.Relational) and index < 2:
+                frame[1] = index + 1
+                stack.append([children[index], 0])
+                continue
+            stack.pop()
+
+            if node_type == ASTNodeType.IntLiteral:
+                values.append(int(node.get_text()))
+            elif node_type == ASTNodeType.Identifier:
+                var_name = node.get_text()
+                if var_name not in env:
+                    raise Exception('unknown variable: ' + var_name)
+                if env[var_name] is None:
+                    raise Exception('variavle ' + var_name + ' has not been set any value')
+                values.append(env[var_name])
+            else:
+                right = self.truncate(values.pop())
+                left = self.truncate(values.pop())
+                values.append(self.apply(node_type, node.get_text(), left, right))
+        return values[0]
+
+    # 二元运算，操作数可能是标量，也可能是整列
+    def apply(self, node_type, op, left, right):
+        if node_type == ASTNodeType.Relational:
+            return self.compare(op, left, right)
+        if node_type == ASTNodeType.Additive:
+            op = '+' if op == '+' else '-'
+        else:
+            op = '*' if op == '*' else '/'
+        if op == '/':
+            self.check_divisor(right)
+
+        if self.use_numpy or not (isinstance(left, array) or isinstance(right, array)):
+            if op == '+':
+                return left + right
+            if op == '-':
+                return left - right
+            if op == '*':
+                return left * right
+            return left / right
+
+        # array('q')没有逐元素运算，用列表推导逐个计算
+        rows = len(left) if isinstance(left, array) else len(right)
+        left = left if isinstance(left, array) else [left] * rows
+        right = right if isinstance(right, array) else [right] * rows
+        if op == '+':
+            return array('q', [a + b for a, b in zip(left, right)])
+        if op == '-':
+            return array('q', [a - b for a, b in zip(left, right)])
+        if op == '*':
+            return array('q', [a * b for a, b in zip(left, right)])
+        return array('d', [a / b for a, b in zip(left, right)])
+
+    # 比较，结果是1或0
+    def compare(self, op, left, right):
+        if self.use_numpy and (isinstance(left, numpy.ndarray) or isinstance(right, numpy.ndarray)):
+            return _NUMPY_COMPARISONS[op](left, right).astype(numpy.int64)
+        compare = RELATIONAL_OPERATORS[op]
+        if not (isinstance(left, array) or isinstance(right, array)):
+            return compare(left, right)
+        rows = len(left) if isinstance(left, array) else len(right)
+        left = left if isinstance(left, array) else [left] * rows
+        right = right if isinstance(right, array) else [right] * rows
+        return array('q', [compare(a, b) for a, b in zip(left, right)])
+
+    # 和Python一样，除以0时抛出异常，而不是像NumPy那样得到inf
+    def check_divisor(self, right):
+        if self.use_numpy and isinstance(right, numpy.ndarray):
+            if (right == 0).any():
+                raise ZeroDivisionError('division by zero')
+        elif not self.use_numpy and isinstance(right, array):
+            if 0 in right:
+                raise ZeroDivisionError('division by zero')
+        elif right == 0:
+            raise ZeroDivisionError('division by zero')
+
+    # 与evaluate中的int()相同：把除法得到的浮点数向零取整
+    def truncate(self, value):
+        if value is None:
+            return None
+        if self.use_numpy and isinstance(value, numpy.ndarray):
+            if value.dtype.kind == 'f':
+                return numpy.trunc(value).astype(numpy.int64)
+            return value
+        if isinstance(value, array):
+            if value.typecode == 'd':
+                return array('q', [int(v) for v in value])
+            return value
+        return int(value)
+
+    # 标量扩展成整列
+    def broadcast(self, value, rows):
+        if value is None:
+            return None
+        if self.use_numpy:
+            if isinstance(value, numpy.ndarray):
+                return value
+            return numpy.full(rows, value, dtype=numpy.int64)
+        if isinstance(value, array):
+            return value
+        return array('q', [value] * rows)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.simple_parser import SimpleParser
+from play_with_compiler.craft.simple_script import SimpleScript
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+import itertools
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+'''
+并行执行大量互相独立的脚本。
+脚本被分片发给一个进程池，每个工作进程独立地解析、求值；发给工作进程的只有脚本的名字和源代码。
+同时发出去的分片数有上限，脚本是边执行边读入的，不会一开始就把所有的脚本文件读进内存。
+结果按输入的顺序流式返回，同时统计每个工作进程的吞吐量。
+
+用法：python -m play_with_compiler.craft.batch_runner -j 8 a.play b.play ...
+'''
+
+'''
+一个脚本的执行结果
+'''
+class ScriptResult(object):
+    def __init__(self, name, output, variables, error, worker, seconds):
+        self.name = name            # 脚本的名字，通常是文件名
+        self.output = output        # 脚本执行时打印的内容
+        self.variables = variables  # 执行结束时的变量表
+        self.error = error          # 出错时的错误信息，否则是None
+        self.worker = worker        # 执行它的工作进程的pid
+        self.seconds = seconds      # 解析和求值花的时间
+
+'''
+每个工作进程执行了多少个脚本、花了多少时间
+'''
+class WorkerStats(object):
+    def __init__(self):
+        self.scripts = {}   # pid -> 脚本数
+        self.seconds = {}   # pid -> 秒数
+
+    def add(self, result):
+        self.scripts[result.worker] = self.scripts.get(result.worker, 0) + 1
+        self.seconds[result.worker] = self.seconds.get(result.worker, 0.0) + result.seconds
+
+    def dump(self, file=sys.stderr):
+        print('worker\tscripts\tseconds\tscripts/s', file=file)
+        for worker in sorted(self.scripts):
+            seconds = self.seconds[worker]
+            rate = self.scripts[worker] / seconds if seconds > 0 else float('inf')
+            print('{}\t{}\t{:.3f}\t{:.0f}'.format(worker, self.scripts[worker], seconds, rate), file=file)
+
+'''
+在工作进程中执行一个脚本。job是 (名字, 源代码)。
+'''
+def run_script(job):
+    name, source = job
+    start = time.perf_counter()
+    script = SimpleScript(False)
+    output = io.StringIO()
+    error = None
+    try:
+        with contextlib.redirect_stdout(output):
+            script.evaluate(SimpleParser().parse(source), '')
+    except Exception as e:
+        error = str(e)
+    return ScriptResult(name, output.getvalue(), dict(script._variables.items()), error,
+                        os.getpid(), time.perf_counter() - start)
+
+# 在工作进程中执行一片脚本
+def run_chunk(chunk):
+    return [run_script(job) for job in chunk]
+
+'''
+并行执行jobs中的脚本，按输入的顺序逐个返回ScriptResult。
+jobs是 (名字, 源代码) 的迭代器；每chunksize个脚本作为一片发给一个工作进程。
+最多有2 * workers片（2 * workers * chunksize个脚本）已经从jobs中取出、还没有返回，
+每个工作进程执行完一片时，下一片已经在等着它了。
+stats不为None时，把每个结果记入stats。
+'''
+def run_batch(jobs, workers=None, chunksize=16, stats=None):
+    workers = workers if workers != None else os.cpu_count() or 1
+    window = 2 * workers
+    jobs = iter(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = deque() # 按提交的顺序
+        while True:
+            while len(futures) < window:
+                chunk = list(itertools.islice(jobs, chunksize))
+                if not chunk:
+                    break
+                futures.append(executor.submit(run_chunk, chunk))
+            if not futures:
+                break
+            if not futures[0].done():
+                wait([future for future in futures if not future.done()], return_when=FIRST_COMPLETED)
+            while futures and futures[0].done(): # 按顺序返回已经完成的分片
+                for result in futures.popleft().result():
+                    if stats != None:
+                        stats.add(result)
+                    yield result
+
+# 逐个读取脚本文件
+def read_jobs(paths):
+    for path in paths:
+        with open(path) as file:
+            yield (path, file.read())
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run many scripts in parallel')
+    parser.add_argument('paths', nargs='+', help='script files')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=16, help='scripts sent to a worker at a time')
+    options = parser.parse_args(args)
+
+    stats = WorkerStats()
+    start = time.perf_counter()
+    count = 0
+    for result in run_batch(read_jobs(options.paths), options.workers, options.chunksize, stats):
+        count += 1
+        print('== {}'.format(result.name))
+        sys.stdout.write(result.output)
+        if result.error != None:
+            print('error: {}'.format(result.error))
+    seconds = time.perf_counter() - start
+    stats.dump()
+    print('total\t{}\t{:.3f}\t{:.0f}'.format(count, seconds, count / seconds if seconds > 0 else 0), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.simple_lexer import SimpleLexer
+from play_with_compiler.craft.simple_parser import SimpleParser
+from play_with_compiler.craft.precedence_parser import PrecedenceParser
+from play_with_compiler.craft.ll1_parser import LL1Parser
+from play_with_compiler.craft.simple_script import SimpleScript
+from play_with_compiler.craft.simple_calculator import SimpleASTNode, SimpleCalculator, freeze_tree
+from play_with_compiler.craft.script_cache import ScriptCache
+from play_with_compiler.craft.base_type import ASTNodeType
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+'''
+性能测试。
+用法：python -m play_with_compiler.craft.benchmark lexer
+      python -m play_with_compiler.craft.benchmark lexer --sizes 1,10,100 --modes table,regex,compact
+      python -m play_with_compiler.craft.benchmark memory --sizes 10 --modes table,compact
+      python -m play_with_compiler.craft.benchmark parser --statements 100000
+      python -m play_with_compiler.craft.benchmark expression --statements 100000
+      python -m play_with_compiler.craft.benchmark evaluate --statements 1000 --repeat 20
+      python -m play_with_compiler.craft.benchmark evaluate --workload chain --statements 100000 --repeat 5
+      python -m play_with_compiler.craft.benchmark nodes --nodes 1000000
+      python -m play_with_compiler.craft.benchmark startup --statements 10000 --scripts 10
+      python -m play_with_compiler.craft.benchmark suite --scale 10000 --output before.json
+      python -m play_with_compiler.craft.benchmark compare before.json after.json
+'''
+
+# 生成测试脚本时循环使用的语句，覆盖了所有Token类型
+_SAMPLE_STATEMENTS = [
+    'int age = 45;\n',
+    'int total = price * qty - discount / 2;\n',
+    'age = age + (b1 - 3) * 7;\n',
+    'inta >= 10;\n',
+    'result = (x1 + y2) * (z3 - 100) / 4 > 0;\n',
+]
+
+'''
+生成大约size_mb兆字节的脚本
+'''
+def generate_script(size_mb):
+    block = ''.join(_SAMPLE_STATEMENTS)
+    return block * (int(size_mb * 1024 * 1024) // len(block) + 1)
+
+'''
+测量一个函数的耗时，返回 (秒数, 函数的返回值)
+和timeit一样，计时期间关闭垃圾回收，否则建树时频繁触发的GC会掩盖被测代码本身的差别。
+'''
+def measure(func, *args):
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = func(*args)
+        return time.perf_counter() - start, result
+    finally:
+        gc.enable()
+
+'''
+比较各种词法分析模式的吞吐量，单位是每秒Token数
+'''
+def bench_lexer(sizes, modes):
+    print('size(MB)\tmode\t\ttokens\t\tseconds\t\ttokens/s')
+    for size in sizes:
+        script = generate_script(size)
+        for mode in modes:
+            lexer = SimpleLexer(mode)
+            seconds, reader = measure(lexer.tokenize, script)
+            count = len(reader.tokens)
+            print('{}\t\t{}\t\t{}\t{:.3f}\t\t{:.0f}'.format(size, mode, count, seconds, count / seconds))
+            lexer.tokens = None
+            reader = None
+
+'''
+比较各种词法分析模式下，Token流平均每个Token占用的内存（不含源代码本身）
+'''
+def bench_token_memory(sizes, modes):
+    print('size(MB)\tmode\t\ttokens\t\tbytes/token')
+    for size in sizes:
+        script = generate_script(size)
+        for mode in modes:
+            lexer = SimpleLexer(mode)
+            tracemalloc.start()
+            reader = lexer.tokenize(script)
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            count = len(reader.tokens)
+            print('{}\t\t{}\t\t{}\t{:.1f}'.format(size, mode, count, used / count))
+            lexer.tokens = None
+            reader = None
+
+'''
+生成以赋值语句为主的脚本：先声明width个变量，然后是count条赋值语句，每隔几条插入一个表达式语句
+'''
+def generate_assignments(count, width=10):
+    lines = ['int x{} = {};\n'.format(i, i) for i in range(width)]
+    for i in range(count):
+        target = i % width
+        if i % 5 == 4:
+            lines.append('x{} + x{} * 2;\n'.format(target, (i + 1) % width))
+        else:
+            # 系数之和小于除数，变量的值不会无限增长
+            lines.append('x{} = (x{} + x{} * 3 - {}) / 7 + {};\n'.format(
+                target, (i + 3) % width, (i + 7) % width, i % 97, i % 13))
+    return ''.join(lines)
+
+'''
+比较回溯方式、预测分析方式和表驱动的LL(1)分析的语法分析吞吐量，单位是每秒语句数。
+只计算语法分析的时间，词法分析事先完成。
+'''
+def bench_parser(statements):
+    script = generate_assignments(statements)
+    print('statements\tmode\t\tseconds\t\tstatements/s')
+    for mode, parser in (('backtrack', SimpleParser(False)), ('predictive', SimpleParser(True)), ('ll1', LL1Parser())):
+        tokens = SimpleLexer().tokenize(script)
+        seconds, tree = measure(parser.prog, tokens)
+        count = len(tree.get_children())
+        print('{}\t\t{:<10}\t{:.3f}\t\t{:.0f}'.format(count, mode, seconds, count / seconds))
+
+'''
+生成一个很长的左结合表达式语句，如 int x0 = 1; x0 + 1 - 2 + 3 ...;
+'''
+def generate_chain(terms):
+    parts = ['x0']
+    for i in range(1, terms):
+        parts.append(('+' if i % 2 else '-') + str(i % 10))
+    return 'int x0 = 1;\n' + ''.join(parts) + ';\n'
+
+# AST节点数
+def count_nodes(tree):
+    count = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.get_children())
+    return count
+
+'''
+比较三种求值方式的速度：遍历AST、编译成闭包、编译成字节码在虚拟机上执行。
+脚本解析一次、编译一次，然后重复执行repeat次；打印输出被丢弃，几种方式都同样打印。
+workload为'assignments'时是statements条赋值语句，为'chain'时是一个statements项的长表达式。
+'''
+def bench_evaluate(statements, repeat, workload='assignments'):
+    if workload == 'chain':
+        tree = SimpleParser().parse(generate_chain(statements))
+    else:
+        tree = SimpleParser().parse(generate_assignments(statements))
+    nodes = count_nodes(tree) * repeat
+    print('nodes\t\tmode\t\tcompile(s)\trun(s)\t\tnodes/s')
+    with open(os.devnull, 'w') as devnull:
+        for mode in ('tree walker', 'closure', 'vm'):
+            script = SimpleScript(False)
+            with contextlib.redirect_stdout(devnull):
+                if mode == 'tree walker':
+                    compile_seconds = 0.0
+                    seconds, _ = measure(lambda: [script.evaluate(tree, '') for i in range(repeat)])
+                else:
+                    compile_seconds, program = measure(script.compile, tree, mode)
+                    seconds, _ = measure(lambda: [script.run(program) for i in range(repeat)])
+            print('{}\t\t{:<12}\t{:.3f}\t\t{:.3f}\t\t{:.0f}'.format(nodes, mode, compile_seconds, seconds, nodes / seconds))
+
+'''
+统计执行func期间Python函数调用的次数，返回 (调用次数, 函数的返回值)
+'''
+def count_calls(func, *args):
+    calls = [0]
+    def profile(frame, event, arg):
+        if event == 'call':
+            calls[0] += 1
+    sys.setprofile(profile)
+    try:
+        result = func(*args)
+    finally:
+        sys.setprofile(None)
+    return calls[0], result
+
+# 表达式的操作数个数，即IntLiteral和Identifier节点数
+def count_operands(tree):
+    count = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node.get_type() == ASTNodeType.IntLiteral or node.get_type() == ASTNodeType.Identifier:
+            count += 1
+        stack.extend(node.get_children())
+    return count
+
+'''
+比较递归下降（SimpleParser）和按运算符优先级（PrecedenceParser）解析表达式：
+每个操作数平均的Python函数调用次数（包括读取Token的调用），以及每秒解析的操作数。
+只计算语法分析，词法分析事先完成。
+'''
+def bench_expression(statements):
+    script = generate_assignments(statements)
+    print('operands\tparser\t\tcalls/operand\tseconds\t\toperands/s')
+    for name, parser in (('recursive', SimpleParser()), ('precedence', PrecedenceParser())):
+        calls, tree = count_calls(parser.prog, SimpleLexer().tokenize(script))
+        operands = count_operands(tree)
+        tree = None
+        seconds, tree = measure(parser.prog, SimpleLexer().tokenize(script))
+        print('{}\t\t{:<12}\t{:.2f}\t\t{:.3f}\t\t{:.0f}'.format(
+            operands, name, calls / operands, seconds, operands / seconds))
+
+'''
+原来的AST节点实现：每个节点带一个__dict__，叶子节点也有自己的空列表。用来和SimpleASTNode比较。
+'''
+class _DictASTNode(object):
+    def __init__(self, node_type, text):
+        self.parent = None
+        self.children = []
+        self.node_type = node_type
+        self.text = text
+
+    def add_child(self, child):
+        self.children.append(child)
+        child.parent = self
+
+    def get_children(self):
+        return self.children
+
+'''
+按SimpleParser的方式构造一棵大约有nodes个节点的左结合加法树：x0 + 1 - 2 + 3 ...
+'''
+def build_chain_tree(node_class, nodes):
+    texts = [str(i) for i in range(10)]
+    root = node_class(ASTNodeType.Identifier, 'x0')
+    for i in range(1, nodes // 2 + 1):
+        node = node_class(ASTNodeType.Additive, '+' if i % 2 else '-')
+        child = node_class(ASTNodeType.IntLiteral, texts[i % 10])
+        if node_class is SimpleASTNode:
+            node.add_children(root, child)
+        else:
+            node.add_child(root)
+            node.add_child(child)
+        root = node
+    return root
+
+'''
+比较原来的节点和使用__slots__的SimpleASTNode：构造一棵大树的时间，以及平均每个节点占用的内存。
+SimpleASTNode的树构造完后还要冻结（SimpleParser.parse也是这样），冻结的时间单独列出。
+'''
+def bench_nodes(nodes):
+    print('nodes\t\tclass\t\tbuild(s)\tfreeze(s)\tnodes/s\t\tbytes/node')
+    for name, node_class in (('dict', _DictASTNode), ('slots', SimpleASTNode)):
+        seconds, tree = measure(build_chain_tree, node_class, nodes)
+        freeze_seconds = 0.0
+        if node_class is SimpleASTNode:
+            freeze_seconds, _ = measure(freeze_tree, tree)
+        count = count_nodes(tree)
+        tree = None
+        gc.collect()
+        tracemalloc.start()
+        tree = build_chain_tree(node_class, nodes)
+        if node_class is SimpleASTNode:
+            freeze_tree(tree)
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tree = None
+        print('{}\t\t{}\t\t{:.3f}\t\t{:.3f}\t\t{:.0f}\t\t{:.1f}'.format(
+            count, name, seconds, freeze_seconds, count / (seconds + freeze_seconds), used / count))
+
+'''
+模拟服务启动时加载库脚本：scripts个脚本，每个statements条语句。
+比较不用缓存（每次都解析）、冷启动（缓存目录是空的，解析后写入缓存）和热启动（从缓存读取）的时间。
+每次启动都用新的ScriptCache对象，只有磁盘上的文件是共享的。
+'''
+def bench_startup(statements, scripts, optimize=False):
+    sources = ['int lib{} = {};\n'.format(i, i) + generate_assignments(statements) for i in range(scripts)]
+    directory = tempfile.mkdtemp(prefix='pwc-cache-')
+    try:
+        parser = SimpleParser()
+        no_cache, _ = measure(lambda: [parser.parse(source) for source in sources])
+        cold, _ = measure(lambda: [ScriptCache(directory, optimize=optimize).parse(source) for source in sources])
+        warm_cache = ScriptCache(directory, optimize=optimize)
+        warm, _ = measure(lambda: [warm_cache.parse(source) for source in sources])
+        size = sum(entry.stat().st_size for entry in os.scandir(directory))
+        print('scripts\tstatements\tno cache(s)\tcold(s)\t\twarm(s)\t\tspeedup\t\tcache bytes')
+        print('{}\t{}\t\t{:.3f}\t\t{:.3f}\t\t{:.3f}\t\t{:.1f}x\t\t{}'.format(
+            scripts, statements, no_cache, cold, warm, no_cache / warm, size))
+        print('warm start: {}'.format(warm_cache.stats()))
+    finally:
+        shutil.rmtree(directory)
+
+'''
+基准测试套件的各种负载。每个生成函数返回 (脚本, 表达式)：
+脚本给SimpleLexer、SimpleParser、SimpleScript使用；表达式给只能解析一个表达式的SimpleCalculator使用，
+没有合适的表达式时是None。生成的内容只由scale决定，每次都一样，便于在不同的提交之间比较。
+'''
+
+# 很长的左结合表达式：x0 + 1 - 2 + 3 ...
+def workload_chain(scale):
+    expression = ''.join(('+' if i % 2 else '-') + str(i % 10) for i in range(1, scale))
+    return generate_chain(scale), '1' + expression
+
+# 很宽的、用括号组成的平衡二叉树：((1*2)+(3*4))-((5*6)+(7*8)) ...
+def workload_wide(scale):
+    items = [str(i % 10) for i in range(max(scale, 2))]
+    level = 0
+    while len(items) > 1:
+        op = '*' if level == 0 else ('+' if level % 2 else '-')
+        merged = ['(' + items[i] + op + items[i + 1] + ')' for i in range(0, len(items) - 1, 2)]
+        if len(items) % 2:
+            merged.append(items[-1])
+        items = merged
+        level += 1
+    return items[0] + ';\n', items[0]
+
+# 大量的变量声明，一半有初始值
+def workload_declarations(scale):
+    lines = []
+    for i in range(scale):
+        if i % 2:
+            lines.append('int v{};\n'.format(i))
+        else:
+            lines.append('int v{} = {};\n'.format(i, i))
+    return ''.join(lines), None
+
+# 64个字符长的标识符，每个变量声明后被下一个语句读取
+def workload_long_identifiers(scale, length=64):
+    names = ['v' + 'x' * (length - 1 - len(str(i))) + str(i) for i in range(scale)]
+    lines = ['int {} = 1;\n'.format(names[0])]
+    for i in range(1, scale):
+        lines.append('int {} = {} + {};\n'.format(names[i], names[i - 1], i % 10))
+    return ''.join(lines), ' + '.join(names)
+
+# 100位的整数字面量
+def workload_large_literals(scale, digits=100):
+    literals = [(str(i % 9 + 1) * digits) for i in range(scale)]
+    lines = []
+    for i in range(scale):
+        lines.append('int big{} = {} + {};\n'.format(i, literals[i], literals[(i + 1) % scale]))
+    return ''.join(lines), '+'.join(literals)
+
+WORKLOADS = {
+    'chain': workload_chain,
+    'wide': workload_wide,
+    'declarations': workload_declarations,
+    'long_identifiers': workload_long_identifiers,
+    'large_literals': workload_large_literals,
+}
+
+STAGES = ['lexer', 'parser', 'calculator', 'evaluate']
+
+'''
+测量一个阶段：最快的一次耗时，以及单独运行一次时的内存峰值（只计运行过程中新分配的内存）
+'''
+def measure_stage(func, repeat):
+    seconds = min(measure(func)[0] for i in range(repeat))
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+'''
+在一个负载上运行各个阶段，返回结果记录的列表。
+每个阶段的输入事先准备好，只测量这个阶段本身；units是这个阶段处理的Token数或AST节点数。
+'''
+def run_workload(name, scale, repeat, stages):
+    script, expression = WORKLOADS[name](scale)
+    tokens = len(SimpleLexer().tokenize(script).tokens)
+    tree = SimpleParser().parse(script)
+    nodes = count_nodes(tree)
+    records = []
+
+    def record(stage, func, size, units, unit):
+        seconds, peak = measure_stage(func, repeat)
+        records.append({
+            'workload': name, 'stage': stage, 'scale': scale, 'bytes': size,
+            'units': units, 'unit': unit, 'seconds': seconds,
+            'per_second': units / seconds if seconds > 0 else None, 'peak_bytes': peak,
+        })
+
+    if 'lexer' in stages:
+        record('lexer', lambda: SimpleLexer().tokenize(script), len(script), tokens, 'tokens')
+    if 'parser' in stages:
+        record('parser', lambda: SimpleParser().parse(script), len(script), nodes, 'nodes')
+    if 'calculator' in stages and expression != None:
+        calculator_nodes = count_nodes(SimpleCalculator().parse(expression))
+        record('calculator', lambda: SimpleCalculator().parse(expression), len(expression), calculator_nodes, 'nodes')
+    if 'evaluate' in stages:
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                record('evaluate', lambda: SimpleScript(False).evaluate(tree, ''), len(script), nodes, 'nodes')
+    return records
+
+# 记录运行环境，比较结果时用来确认是同一台机器
+def environment():
+    commit = None
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except Exception:
+        pass
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+'''
+运行基准测试套件，打印结果表格，output不为None时把结果写成JSON文件
+'''
+def bench_suite(scale, repeat, workloads, stages, output=None):
+    results = {'environment': environment(), 'scale': scale, 'repeat': repeat, 'results': []}
+    print('workload\t\tstage\t\tunits\t\tseconds\t\tunits/s\t\tpeak(KB)')
+    for name in workloads:
+        for item in run_workload(name, scale, repeat, stages):
+            results['results'].append(item)
+            print('{:<16}\t{:<10}\t{}\t\t{:.4f}\t\t{:.0f}\t\t{:.0f}'.format(
+                name, item['stage'], item['units'], item['seconds'], item['per_second'] or 0, item['peak_bytes'] / 1024))
+    if output != None:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    return results
+
+'''
+比较两次运行套件的结果。吞吐量下降或内存峰值增长超过threshold的记为退化，有退化时返回False。
+'''
+def compare_results(old_path, new_path, threshold=0.1):
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    if old['scale'] != new['scale']:
+        raise Exception('results were measured at different scales: {} and {}'.format(old['scale'], new['scale']))
+    old_items = dict(((item['workload'], item['stage']), item) for item in old['results'])
+    ok = True
+    print('workload\t\tstage\t\tspeed\t\tpeak')
+    for item in new['results']:
+        key = (item['workload'], item['stage'])
+        if key not in old_items:
+            continue
+        before = old_items[key]
+        speed = item['per_second'] / before['per_second'] if before['per_second'] and item['per_second'] else 1.0
+        peak = item['peak_bytes'] / before['peak_bytes'] if before['peak_bytes'] else 1.0
+        regressed = speed < 1 - threshold or peak > 1 + threshold
+        ok = ok and not regressed
+        print('{:<16}\t{:<10}\t{:.2f}x\t\t{:.2f}x{}'.format(key[0], key[1], speed, peak, '\tREGRESSION' if regressed else ''))
+    return ok
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='PlayWithCompiler benchmarks')
+    subparsers = parser.add_subparsers(dest='target')
+
+    lexer_parser = subparsers.add_parser('lexer', help='tokenize throughput')
+    lexer_parser.add_argument('--sizes', default='1', help='input sizes in MB, comma separated, e.g. 1,10,100')
+    lexer_parser.add_argument('--modes', default='dfa,table,regex,compact', help='lexer modes, comma separated')
+
+    memory_parser = subparsers.add_parser('memory', help='token stream memory per token')
+    memory_parser.add_argument('--sizes', default='10', help='input sizes in MB, comma separated')
+    memory_parser.add_argument('--modes', default='table,compact', help='lexer modes, comma separated')
+
+    parser_parser = subparsers.add_parser('parser', help='statements per second, backtracking vs predictive vs ll1 table')
+    parser_parser.add_argument('--statements', type=int, default=100000, help='number of statements')
+
+    expression_parser = subparsers.add_parser('expression', help='calls per operand, recursive descent vs precedence')
+    expression_parser.add_argument('--statements', type=int, default=100000, help='number of statements')
+
+    evaluate_parser = subparsers.add_parser('evaluate', help='tree walker vs compiled closures vs bytecode vm')
+    evaluate_parser.add_argument('--statements', type=int, default=1000, help='number of statements')
+    evaluate_parser.add_argument('--repeat', type=int, default=20, help='how many times the script is evaluated')
+    evaluate_parser.add_argument('--workload', default='assignments', choices=['assignments', 'chain'])
+
+    nodes_parser = subparsers.add_parser('nodes', help='AST node construction time and memory')
+    nodes_parser.add_argument('--nodes', type=int, default=1000000, help='number of nodes in the tree')
+
+    startup_parser = subparsers.add_parser('startup', help='loading scripts without cache, cold and warm disk cache')
+    startup_parser.add_argument('--statements', type=int, default=10000, help='statements per script')
+    startup_parser.add_argument('--scripts', type=int, default=10, help='number of scripts')
+    startup_parser.add_argument('--optimize', action='store_true', help='cache optimized ASTs')
+
+    suite_parser = subparsers.add_parser('suite', help='all stages on generated workloads, machine-readable results')
+    suite_parser.add_argument('--scale', type=int, default=10000, help='statements or terms per workload')
+    suite_parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the fastest is reported')
+    suite_parser.add_argument('--workloads', default=','.join(sorted(WORKLOADS)), help='workloads, comma separated')
+    suite_parser.add_argument('--stages', default=','.join(STAGES), help='stages, comma separated')
+    suite_parser.add_argument('--output', default=None, help='write results to this JSON file')
+
+    compare_parser = subparsers.add_parser('compare', help='compare two JSON results written by suite')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative slowdown or memory growth')
+
+    options = parser.parse_args(args)
+    if options.target == 'lexer':
+        bench_lexer([float(s) for s in options.sizes.split(',')], options.modes.split(','))
+    elif options.target == 'memory':
+        bench_token_memory([float(s) for s in options.sizes.split(',')], options.modes.split(','))
+    elif options.target == 'parser':
+        bench_parser(options.statements)
+    elif options.target == 'expression':
+        bench_expression(options.statements)
+    elif options.target == 'evaluate':
+        bench_evaluate(options.statements, options.repeat, options.workload)
+    elif options.target == 'nodes':
+        bench_nodes(options.nodes)
+    elif options.target == 'startup':
+        bench_startup(options.statements, options.scripts, options.optimize)
+    elif options.target == 'suite':
+        bench_suite(options.scale, options.repeat, options.workloads.split(','), options.stages.split(','), options.output)
+    elif options.target == 'compare':
+        if not compare_results(options.old, options.new, options.threshold):
+            sys.exit(1)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
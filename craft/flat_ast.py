@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType, RELATIONAL_OPERATORS
+from play_with_compiler.craft.simple_calculator import SimpleASTNode
+from array import array
+import mmap
+import struct
+
+'''
+扁平的、可以序列化的AST。
+节点按后序排列（子节点在父节点之前，兄弟节点从左到右），每个节点的信息存放在几个平行的数组中：
+ * types       节点类型的值，array('B')
+ * text_starts, text_ends  节点文本在文本池中的起止位置，array('q')
+ * child_starts, child_counts  子节点在children中的下标范围，array('q')
+ * children    所有子节点的下标，array('q')
+文本池是UTF-8编码的bytes。根节点是最后一个节点。
+
+因为是后序排列，从前往后扫描一遍、用一个值栈就能完成求值，顺序和SimpleScript.evaluate完全一样，
+不需要重建SimpleASTNode对象。二进制文件可以用mmap映射后直接求值。
+'''
+
+'''
+二进制格式的标识和版本，写在文件头的最前面。修改了格式时要改版本号，ScriptCache也用它作为缓存键的一部分。
+'''
+MAGIC = b'PWCAST1\0'
+# 文件头：魔数、字节序标记、节点数、子节点下标数、文本池字节数。数组按本机字节序存放
+_HEADER = struct.Struct('=8sqqqq')
+_BYTE_ORDER_MARK = 0x0102030405060708
+
+_NODE_TYPE_BY_VALUE = [None] * len(ASTNodeType)
+for _node_type in ASTNodeType:
+    _NODE_TYPE_BY_VALUE[_node_type.value] = _node_type
+
+_PROGRAMM = ASTNodeType.Programm.value
+_INT_DECLARATION = ASTNodeType.IntDeclaration.value
+_ASSIGNMENT_STMT = ASTNodeType.AssignmentStmt.value
+_MULTIPLICATIVE = ASTNodeType.Multiplicative.value
+_ADDITIVE = ASTNodeType.Additive.value
+_IDENTIFIER = ASTNodeType.Identifier.value
+_INT_LITERAL = ASTNodeType.IntLiteral.value
+_RELATIONAL = ASTNodeType.Relational.value
+
+class FlatAST(object):
+    def __init__(self, types, text_starts, text_ends, child_starts, child_counts, children, pool):
+        self.types = types
+        self.text_starts = text_starts
+        self.text_ends = text_ends
+        self.child_starts = child_starts
+        self.child_counts = child_counts
+        self.children = children
+        self.pool = pool
+        self.buffer = None # load()时映射的文件
+
+    def __len__(self):
+        return len(self.types)
+
+    # 第index个节点的文本
+    def get_text(self, index):
+        return bytes(self.pool[self.text_starts[index]:self.text_ends[index]]).decode('utf-8')
+
+    # 第index个节点的子节点下标
+    def get_children(self, index):
+        start = self.child_starts[index]
+        return self.children[start:start + self.child_counts[index]]
+
+    '''
+    从SimpleASTNode树生成。用显式的栈做后序遍历。
+    '''
+    @staticmethod
+    def from_tree(root):
+        types = array('B')
+        text_starts = array('q')
+        text_ends = array('q')
+        child_starts = array('q')
+        child_counts = array('q')
+        children = array('q')
+        pool = bytearray()
+        texts = {} # 相同的文本在文本池中只存一份
+
+        stack = [[root, 0, []]] # [节点, 下一个要处理的子节点的下标, 已经生成的子节点的下标]
+        while stack:
+            frame = stack[-1]
+            node, index, child_indexes = frame
+            node_children = node.get_children()
+            if index < len(node_children):
+                frame[1] = index + 1
+                stack.append([node_children[index], 0, []])
+                continue
+            stack.pop()
+
+            text = node.get_text().encode('utf-8')
+            if text not in texts:
+                texts[text] = len(pool)
+                pool.extend(text)
+            types.append(node.get_type().value)
+            text_starts.append(texts[text])
+            text_ends.append(texts[text] + len(text))
+            child_starts.append(len(children))
+            child_counts.append(len(child_indexes))
+            children.extend(child_indexes)
+            if stack:
+                stack[-1][2].append(len(types) - 1)
+        return FlatAST(types, text_starts, text_ends, child_starts, child_counts, children, bytes(pool))
+
+    '''
+    还原成SimpleASTNode树。子节点直接存成元组，得到的树已经是冻结的
+    '''
+    def to_tree(self):
+        nodes = []
+        texts = {} # 文本在池中的起止位置 -> 字符串，相同的文本只解码一次
+        pool = self.pool
+        for index in range(len(self.types)):
+            span = (self.text_starts[index], self.text_ends[index])
+            text = texts.get(span)
+            if text == None:
+                text = bytes(pool[span[0]:span[1]]).decode('utf-8')
+                texts[span] = text
+            node = SimpleASTNode(_NODE_TYPE_BY_VALUE[self.types[index]], text)
+            if self.child_counts[index]:
+                node.add_children(*[nodes[child] for child in self.get_children(index)])
+            nodes.append(node)
+        return nodes[-1] if nodes else None
+
+    '''
+    序列化成二进制格式：文件头，然后是各个数组，最后是文本池。
+    8字节的数组放在前面，保证映射到内存后每个数组都是对齐的。
+    '''
+    def to_bytes(self):
+        parts = [_HEADER.pack(MAGIC, _BYTE_ORDER_MARK, len(self.types), len(self.children), len(self.pool))]
+        for values in (self.text_starts, self.text_ends, self.child_starts, self.child_counts, self.children):
+            parts.append(array('q', values).tobytes())
+        parts.append(array('B', self.types).tobytes())
+        parts.append(bytes(self.pool))
+        return b''.join(parts)
+
+    '''
+    从二进制格式读取。buffer可以是bytes，也可以是mmap；
+    各个数组都是buffer上的memoryview，不复制数据。
+    buffer的长度必须和文件头中记录的各部分的大小一致，被截断或者多出数据的文件报错。
+    '''
+    @staticmethod
+    def from_bytes(buffer):
+        if len(buffer) < _HEADER.size:
+            raise Exception('not a flat AST file')
+        magic, mark, node_count, children_count, pool_size = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise Exception('not a flat AST file')
+        if mark != _BYTE_ORDER_MARK:
+            raise Exception('flat AST file was written on a machine with different byte order')
+        # 每个节点在四个8字节的数组中各占一项，类型占1字节
+        if node_count < 0 or children_count < 0 or pool_size < 0 or \
+                len(buffer) != _HEADER.size + node_count * 33 + children_count * 8 + pool_size:
+            raise Exception('flat AST file is truncated or corrupt')
+        view = memoryview(buffer)
+        offset = _HEADER.size
+        arrays = []
+        for count in (node_count, node_count, node_count, node_count, children_count):
+            arrays.append(view[offset:offset + count * 8].cast('q'))
+            offset += count * 8
+        types = view[offset:offset + node_count]
+        offset += node_count
+        pool = view[offset:offset + pool_size]
+        text_starts, text_ends, child_starts, child_counts, children = arrays
+        return FlatAST(types, text_starts, text_ends, child_starts, child_counts, children, pool)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
+
+    '''
+    把文件映射到内存中读取，用完后调用close()
+    '''
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        flat = FlatAST.from_bytes(buffer)
+        flat.buffer = buffer
+        return flat
+
+    def close(self):
+        if self.buffer != None:
+            for values in (self.types, self.text_starts, self.text_ends, self.child_starts,
+                           self.child_counts, self.children, self.pool):
+                values.release()
+            self.buffer.close()
+            self.buffer = None
+
+    # 顶层语句的下标。根节点是Programm时是它的子节点，否则根节点本身就是唯一的语句
+    def statements(self):
+        root = len(self.types) - 1
+        if root < 0:
+            return []
+        if self.types[root] == _PROGRAMM:
+            return list(self.get_children(root))
+        return [root]
+
+    '''
+    和NameResolver一样，找出在声明之前就被读取或赋值的变量，它们必须已经在variables中。
+    每个语句的节点是连续的一段，倒着扫描正好是NameResolver的遍历顺序，报错时报的是同一个变量。
+    '''
+    def free_names(self):
+        declared = set()
+        names = []
+        start = 0
+        for statement in self.statements():
+            for index in range(statement, start - 1, -1):
+                node_type = self.types[index]
+                if node_type == _IDENTIFIER or node_type == _ASSIGNMENT_STMT:
+                    name = self.get_text(index)
+                    if name not in declared and name not in names:
+                        names.append(name)
+            if self.types[statement] == _INT_DECLARATION: # 声明在初始化表达式求值之后才生效
+                declared.add(self.get_text(statement))
+            start = statement + 1
+        return names
+
+    '''
+    直接在数组上求值，结果和SimpleScript.evaluate(tree, '')（非verbose模式）相同。
+    variables可以是SimpleScript的变量表，也可以是一个字典。
+    '''
+    def evaluate(self, variables, echo=True):
+        for name in self.free_names():
+            if name not in variables:
+                raise Exception('unknown variable: ' + name)
+
+        types = self.types
+        pool = self.pool
+        text_starts = self.text_starts
+        child_counts = self.child_counts
+        statements = set(self.statements())
+        values = []
+        result = None
+        for index in range(len(types)):
+            node_type = types[index]
+            if node_type == _INT_LITERAL:
+                value = int(self.get_text(index))
+            elif node_type == _IDENTIFIER:
+                name = self.get_text(index)
+                value = variables.get(name)
+                if value == None:
+                    raise Exception('variavle ' + name + ' has not been set any value')
+                value = int(value)
+            elif node_type == _ADDITIVE:
+                value2 = values.pop()
+                value1 = values.pop()
+                if pool[text_starts[index]] == 43: # '+'
+                    value = int(value1) + int(value2)
+                else:
+                    value = int(value1) - int(value2)
+            elif node_type == _MULTIPLICATIVE:
+                value2 = values.pop()
+                value1 = values.pop()
+                if pool[text_starts[index]] == 42: # '*'
+                    value = int(value1) * int(value2)
+                else:
+                    value = int(value1) / int(value2)
+            elif node_type == _RELATIONAL:
+                value2 = values.pop()
+                value1 = values.pop()
+                value = RELATIONAL_OPERATORS[self.get_text(index)](int(value1), int(value2))
+            elif node_type == _INT_DECLARATION or node_type == _ASSIGNMENT_STMT:
+                value = None
+                var_value = None
+                if child_counts[index] > 0:
+                    value = values.pop()
+                    var_value = int(value)
+                variables[self.get_text(index)] = var_value
+            else: # Programm
+                continue
+
+            if index in statements:
+                result = value
+                if echo:
+                    if node_type == _INT_DECLARATION or node_type == _ASSIGNMENT_STMT:
+                        print('%s: %s' %(self.get_text(index), value))
+                    else:
+                        print(value)
+            else:
+                values.append(value)
+        return result
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType, TokenType
+from play_with_compiler.craft.simple_lexer import SimpleLexer, SimpleTokenReader, TokenBuffer, _TOKEN_PATTERN
+from play_with_compiler.craft.simple_parser import SimpleParser
+from play_with_compiler.craft.simple_calculator import SimpleASTNode, freeze_tree
+from array import array
+
+'''
+增量语法分析，用于编辑器中反复修改同一段长脚本的场景。
+每个顶层语句都以分号结束，分号不会出现在语句内部，所以分号就是语句的边界。
+一次编辑之后，从受影响的第一个语句开头重新做词法分析，直到遇到一个编辑位置之后、
+原来就存在的语句结尾分号，从那里开始后面的Token和原来完全一样，只是位置平移了。
+只有这中间的语句重新做语法分析，其他语句的SimpleASTNode原样复用。
+
+用法：
+    parser = IncrementalParser()
+    state = parser.parse(script)
+    state = parser.edit(state, offset, removed, inserted)
+    state.root
+'''
+
+_SEMICOLON = TokenType.SemiColon.value
+
+'''
+一次解析的结果：源代码、Token（带位置的TokenBuffer）、AST，以及每个语句的分号在Token中的下标。
+relexed_tokens、reparsed_statements、reused_statements记录得到这个结果时做了多少工作。
+'''
+class ParseState(object):
+    def __init__(self, source, tokens, root, statement_ends):
+        self.source = source
+        self.tokens = tokens
+        self.root = root
+        self.statement_ends = statement_ends  # array('q')，第i个语句最后一个Token（分号）的下标
+        self.relexed_tokens = len(tokens)
+        self.reparsed_statements = len(statement_ends)
+        self.reused_statements = 0
+
+class IncrementalParser(object):
+    def __init__(self, parser=None):
+        self.parser = parser if parser != None else SimpleParser()
+
+    '''
+    完整地解析一段脚本
+    '''
+    def parse(self, source):
+        lexer = SimpleLexer('compact')
+        tokens = lexer.tokenize(source).tokens
+        root = freeze_tree(self.parser.prog(SimpleTokenReader(tokens)))
+        statement_ends = array('q', [i for i in range(len(tokens)) if tokens.types[i] == _SEMICOLON])
+        return ParseState(source, tokens, root, statement_ends)
+
+    '''
+    把源代码中从offset开始的removed个字符替换成inserted，返回新的ParseState。
+    调用之后原来的state就失效了，不能再使用：被复用的语句节点的parent已经指向新的根节点，
+    state.root的子节点的parent不再是state.root。需要保留旧版本时，先把它完整地重新解析一遍。
+    新的脚本有语法错误时抛出异常，和完整解析时的报错相同。
+    '''
+    def edit(self, state, offset, removed, inserted):
+        old_source = state.source
+        if offset < 0 or removed < 0 or offset + removed > len(old_source):
+            raise Exception('invalid edit: offset ' + str(offset) + ', removed ' + str(removed))
+        source = old_source[:offset] + inserted + old_source[offset + removed:]
+        delta = len(inserted) - removed
+        old_tokens = state.tokens
+        old_ends = state.statement_ends
+        count = len(old_ends)
+
+        # 受影响的第一个语句：它的分号结束在编辑位置之后
+        first = self.first_statement_ending_after(old_tokens, old_ends, offset)
+        first_token = old_ends[first - 1] + 1 if first > 0 else 0
+        start = old_tokens.ends[old_ends[first - 1]] if first > 0 else 0
+
+        # 重新做词法分析，直到遇到原来就存在的语句结尾分号
+        token_types = TokenType.__members__
+        region = TokenBuffer(source)
+        last = count - 1   # 被重新解析的最后一个语句；没有遇到原来的分号时一直到结尾
+        unchanged = offset + len(inserted) # 新源代码中从这里开始的文本没有变化
+        for m in _TOKEN_PATTERN.finditer(source, start):
+            region.append(token_types[m.lastgroup], m.start(), m.end())
+            if m.lastgroup == 'SemiColon' and m.start() >= unchanged:
+                statement = self.find_statement(old_tokens, old_ends, first, m.start() - delta)
+                if statement >= 0:
+                    last = statement
+                    break
+
+        root = freeze_tree(self.parser.prog(SimpleTokenReader(region)))
+
+        # 拼接Token：前面的原样复制，中间是新的，后面的平移位置
+        resume = old_ends[last] + 1 if last >= 0 else 0
+        tokens = TokenBuffer(source)
+        tokens.types = old_tokens.types[:first_token] + region.types + old_tokens.types[resume:]
+        tokens.starts = old_tokens.starts[:first_token] + region.starts + self.shift(old_tokens.starts[resume:], delta)
+        tokens.ends = old_tokens.ends[:first_token] + region.ends + self.shift(old_tokens.ends[resume:], delta)
+
+        token_delta = first_token + len(region) - resume
+        statement_ends = (old_ends[:first]
+                          + array('q', [first_token + i for i in range(len(region)) if region.types[i] == _SEMICOLON])
+                          + self.shift(old_ends[last + 1:], token_delta))
+
+        old_children = state.root.get_children()
+        children = old_children[:first] + root.get_children() + old_children[last + 1:]
+        new_root = SimpleASTNode(ASTNodeType.Programm, state.root.get_text())
+        new_root.add_children(*children)
+
+        result = ParseState(source, tokens, new_root, statement_ends)
+        result.relexed_tokens = len(region)
+        result.reparsed_statements = len(root.get_children())
+        result.reused_statements = len(children) - len(root.get_children())
+        return result
+
+    # 第一个分号结束在offset之后的语句的序号，都不是时返回语句数
+    def first_statement_ending_after(self, tokens, statement_ends, offset):
+        low = 0
+        high = len(statement_ends)
+        while low < high:
+            middle = (low + high) // 2
+            if tokens.ends[statement_ends[middle]] > offset:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    # 从第first个语句开始，找分号在position处的语句，找不到时返回-1
+    def find_statement(self, tokens, statement_ends, first, position):
+        low = first
+        high = len(statement_ends)
+        while low < high:
+            middle = (low + high) // 2
+            if tokens.starts[statement_ends[middle]] < position:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(statement_ends) and tokens.starts[statement_ends[low]] == position:
+            return low
+        return -1
+
+    # 数组中的每个数加上delta
+    def shift(self, values, delta):
+        if delta == 0:
+            return values
+        return array('q', [value + delta for value in values])
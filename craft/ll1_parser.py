@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType, TokenType
+from play_with_compiler.craft.simple_lexer import SimpleLexer
+from play_with_compiler.craft.simple_calculator import SimpleASTNode, freeze_tree
+
+'''
+表驱动的LL(1)语法分析器。
+文法是数据：每行一个规则，"左部 -> 右部 | 右部"，空的右部写成ε。右部的符号有三种：
+ * 终结符：TokenType的成员名，如Plus、IntLiteral；
+ * 非终结符：出现在某个规则左部的名字；
+ * 动作：以@开头，在分析到这个位置时执行，用一个值栈构造AST，见ACTIONS。
+Grammar根据文法计算FIRST集、FOLLOW集，生成预测分析表；LL1Parser用一个显式的栈按表分析，不递归，
+所以嵌套再深的括号、再长的表达式也不会超过Python的递归深度限制。
+
+LL(1)文法不能有左递归，左结合的表达式写成尾部循环的形式，由动作在每读完一个操作数之后构造节点：
+    additive -> term additive_tail
+    additive_tail -> Plus @text term @additive additive_tail | ε
+语句开头的标识符既可能是赋值语句的变量，也可能是表达式的第一个操作数，所以提取了左公因子：
+先记下标识符，看下一个Token是不是等号，再决定它是什么。
+
+用法：
+    tree = LL1Parser().parse('int a = 1 + 2 * 3; a;')
+    print(SCRIPT_GRAMMAR.format_table())
+'''
+
+'''
+表达式的文法，SCRIPT_RULES和CALCULATOR_RULES共用。
+优先级从低到高：关系运算（> >= == <= <）、加减、乘除，和PrecedenceParser的BINARY_OPERATORS一致。
+'''
+EXPRESSION_RULES = '''
+expression -> additive relational_tail
+relational_tail -> GE @text additive @relational relational_tail
+                 | GT @text additive @relational relational_tail
+                 | EQ @text additive @relational relational_tail
+                 | LE @text additive @relational relational_tail
+                 | LT @text additive @relational relational_tail
+                 | ε
+additive -> term additive_tail
+additive_tail -> Plus @text term @additive additive_tail
+               | Minus @text term @additive additive_tail
+               | ε
+term -> factor term_tail
+term_tail -> Star @text factor @multiplicative term_tail
+           | Slash @text factor @multiplicative term_tail
+           | ε
+factor -> Identifier @identifier | operand
+operand -> IntLiteral @literal | LeftParen expression RightParen
+'''
+
+'''
+脚本的文法。生成的AST和PrecedenceParser相同，不含关系运算时也和SimpleParser相同。
+operand是不以标识符开头的基础表达式。
+'''
+SCRIPT_RULES = '''
+program -> @program statements
+statements -> statement @statement statements | ε
+statement -> Int Identifier @text declaration SemiColon
+           | Identifier @text identifier_statement SemiColon
+           | operand term_tail additive_tail relational_tail SemiColon
+declaration -> Assignment expression @declare | @declare_empty
+identifier_statement -> Assignment expression @assign
+                      | @to_identifier term_tail additive_tail relational_tail
+''' + EXPRESSION_RULES
+
+'''
+计算器的文法，和SimpleCalculator生成的AST相同：根节点下面最多一个表达式。
+SimpleCalculator会忽略表达式后面多余的Token，这里作为语法错误；SimpleCalculator不支持关系运算，这里支持。
+'''
+CALCULATOR_RULES = '''
+calculator -> @calculator calculation
+calculation -> expression @statement | ε
+''' + EXPRESSION_RULES
+
+# 二元运算：弹出右操作数、运算符文本、左操作数，压入新节点
+def _binary(node_type):
+    def action(values, token):
+        right = values.pop()
+        text = values.pop()
+        node = SimpleASTNode(node_type, text)
+        node.add_children(values[-1], right)
+        values[-1] = node
+    return action
+
+# 声明和赋值：弹出表达式和变量名
+def _statement_with_value(node_type):
+    def action(values, token):
+        child = values.pop()
+        node = SimpleASTNode(node_type, values[-1])
+        node.add_children(child)
+        values[-1] = node
+    return action
+
+def _declare_empty(values, token):
+    values[-1] = SimpleASTNode(ASTNodeType.IntDeclaration, values[-1])
+
+def _add_statement(values, token):
+    child = values.pop()
+    values[-1].add_child(child)
+
+'''
+文法中可以使用的动作。values是值栈，token是最近匹配的终结符。
+'''
+ACTIONS = {
+    'program': lambda values, token: values.append(SimpleASTNode(ASTNodeType.Programm, 'pwc')),
+    'calculator': lambda values, token: values.append(SimpleASTNode(ASTNodeType.Programm, 'Calculator')),
+    'statement': _add_statement,      # 把栈顶的语句加到下面的根节点
+    'text': lambda values, token: values.append(token.get_text()),
+    'literal': lambda values, token: values.append(SimpleASTNode(ASTNodeType.IntLiteral, token.get_text())),
+    'identifier': lambda values, token: values.append(SimpleASTNode(ASTNodeType.Identifier, token.get_text())),
+    'to_identifier': lambda values, token: values.append(SimpleASTNode(ASTNodeType.Identifier, values.pop())),
+    'additive': _binary(ASTNodeType.Additive),
+    'multiplicative': _binary(ASTNodeType.Multiplicative),
+    'relational': _binary(ASTNodeType.Relational),
+    'declare': _statement_with_value(ASTNodeType.IntDeclaration),
+    'declare_empty': _declare_empty,
+    'assign': _statement_with_value(ASTNodeType.AssignmentStmt),
+}
+
+_EOF = '$'           # 输入结束，FOLLOW集和分析表中使用
+_EOF_COLUMN = len(TokenType) # 分析表中输入结束的那一列
+_NONTERMINAL_BASE = len(TokenType) + 1 # 编码后的符号：终结符是TokenType的值，非终结符从这里开始，动作是负数
+
+'''
+文法：计算FIRST集、FOLLOW集和LL(1)预测分析表
+'''
+class Grammar(object):
+    '''
+    rules是文法的文本，第一个规则的左部是开始符号；actions是动作名到函数的映射
+    '''
+    def __init__(self, rules, actions=None):
+        self.actions = actions if actions != None else ACTIONS
+        self.productions = []   # [(左部, [右部的符号])]
+        self.nonterminals = []  # 按出现的顺序
+        self.parse_rules(rules)
+        self.start = self.nonterminals[0]
+        self.check_symbols()
+        self.nullable = set()
+        self.first = {}         # 非终结符 -> FIRST集（终结符名的集合，不含ε，能推导出空串的记在nullable中）
+        self.follow = {}        # 非终结符 -> FOLLOW集，可能包含'$'
+        self.compute_first()
+        self.compute_follow()
+        self.table = {}         # (非终结符, 终结符) -> 产生式的下标
+        self.build_table()
+        self.compile()
+
+    def parse_rules(self, rules):
+        lhs = None
+        for line in rules.strip().splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if '->' in line:
+                lhs, line = [part.strip() for part in line.split('->', 1)]
+                if lhs not in self.nonterminals:
+                    self.nonterminals.append(lhs)
+            elif line.startswith('|') and lhs != None:
+                line = line[1:]
+            else:
+                raise Exception('invalid grammar rule: ' + line)
+            for alternative in line.split('|'):
+                symbols = [symbol for symbol in alternative.split() if symbol != 'ε']
+                self.productions.append((lhs, symbols))
+
+    def is_terminal(self, symbol):
+        return symbol in TokenType.__members__
+
+    def check_symbols(self):
+        for lhs, symbols in self.productions:
+            for symbol in symbols:
+                if symbol.startswith('@'):
+                    if symbol[1:] not in self.actions:
+                        raise Exception('unknown action: ' + symbol)
+                elif not self.is_terminal(symbol) and symbol not in self.nonterminals:
+                    raise Exception('unknown symbol: ' + symbol)
+
+    # 符号串的FIRST集，以及它是否能推导出空串。动作不占位置
+    def first_of(self, symbols):
+        result = set()
+        for symbol in symbols:
+            if symbol.startswith('@'):
+                continue
+            if self.is_terminal(symbol):
+                result.add(symbol)
+                return result, False
+            result |= self.first[symbol]
+            if symbol not in self.nullable:
+                return result, False
+        return result, True
+
+    # 不动点迭代，直到FIRST集和nullable都不再变化
+    def compute_first(self):
+        for nonterminal in self.nonterminals:
+            self.first[nonterminal] = set()
+        changed = True
+        while changed:
+            changed = False
+            for lhs, symbols in self.productions:
+                first, nullable = self.first_of(symbols)
+                if not first <= self.first[lhs]:
+                    self.first[lhs] |= first
+                    changed = True
+                if nullable and lhs not in self.nullable:
+                    self.nullable.add(lhs)
+                    changed = True
+
+    def compute_follow(self):
+        for nonterminal in self.nonterminals:
+            self.follow[nonterminal] = set()
+        self.follow[self.start].add(_EOF)
+        changed = True
+        while changed:
+            changed = False
+            for lhs, symbols in self.productions:
+                for i, symbol in enumerate(symbols):
+                    if symbol.startswith('@') or self.is_terminal(symbol):
+                        continue
+                    first, nullable = self.first_of(symbols[i + 1:])
+                    follow = first | self.follow[lhs] if nullable else first
+                    if not follow <= self.follow[symbol]:
+                        self.follow[symbol] |= follow
+                        changed = True
+
+    '''
+    预测分析表：FIRST(右部)中的终结符选这个产生式；右部能推导出空串时，FOLLOW(左部)中的终结符也选它。
+    一个格子里有两个产生式时，文法不是LL(1)的。
+    '''
+    def build_table(self):
+        for index, (lhs, symbols) in enumerate(self.productions):
+            first, nullable = self.first_of(symbols)
+            lookaheads = first | self.follow[lhs] if nullable else first
+            for terminal in lookaheads:
+                other = self.table.get((lhs, terminal))
+                if other != None and other != index:
+                    raise Exception('grammar is not LL(1): ' + lhs + ' has two productions for ' + terminal
+                                    + ': ' + self.format_production(other) + ' and ' + self.format_production(index))
+                self.table[(lhs, terminal)] = index
+
+    '''
+    把分析表编码成列表，供LL1Parser使用：每个非终结符一行，按Token类型的值（最后一列是输入结束）
+    找到要压栈的符号，已经反转好，动作编码成负数。
+    '''
+    def compile(self):
+        self.action_functions = []
+        action_codes = {}
+        codes = []
+        for lhs, symbols in self.productions:
+            encoded = []
+            for symbol in symbols:
+                if symbol.startswith('@'):
+                    if symbol not in action_codes:
+                        action_codes[symbol] = len(self.action_functions)
+                        self.action_functions.append(self.actions[symbol[1:]])
+                    encoded.append(~action_codes[symbol])
+                elif self.is_terminal(symbol):
+                    encoded.append(TokenType[symbol].value)
+                else:
+                    encoded.append(_NONTERMINAL_BASE + self.nonterminals.index(symbol))
+            codes.append(tuple(reversed(encoded)))
+        self.rows = [[None] * (_EOF_COLUMN + 1) for nonterminal in self.nonterminals]
+        for (lhs, terminal), index in self.table.items():
+            column = _EOF_COLUMN if terminal == _EOF else TokenType[terminal].value
+            self.rows[self.nonterminals.index(lhs)][column] = codes[index]
+        self.start_code = _NONTERMINAL_BASE
+
+    def format_production(self, index):
+        lhs, symbols = self.productions[index]
+        return lhs + ' -> ' + (' '.join(symbols) if symbols else 'ε')
+
+    '''
+    FIRST集、FOLLOW集和分析表的文本形式
+    '''
+    def format_table(self):
+        lines = []
+        for nonterminal in self.nonterminals:
+            first = sorted(self.first[nonterminal]) + (['ε'] if nonterminal in self.nullable else [])
+            lines.append('FIRST({}) = {{{}}}'.format(nonterminal, ', '.join(first)))
+        for nonterminal in self.nonterminals:
+            lines.append('FOLLOW({}) = {{{}}}'.format(nonterminal, ', '.join(sorted(self.follow[nonterminal]))))
+        for nonterminal in self.nonterminals:
+            for terminal in list(TokenType.__members__) + [_EOF]:
+                index = self.table.get((nonterminal, terminal))
+                if index != None:
+                    lines.append('M[{}, {}] = {}'.format(nonterminal, terminal, self.format_production(index)))
+        return '\n'.join(lines)
+
+SCRIPT_GRAMMAR = Grammar(SCRIPT_RULES)
+CALCULATOR_GRAMMAR = Grammar(CALCULATOR_RULES)
+
+class LL1Parser(object):
+    '''
+    grammar默认是SCRIPT_GRAMMAR，生成的AST和PrecedenceParser相同；
+    用CALCULATOR_GRAMMAR时和SimpleCalculator相同。
+    '''
+    def __init__(self, grammar=None):
+        self.grammar = grammar if grammar != None else SCRIPT_GRAMMAR
+
+    '''
+    解析脚本。返回的AST已经冻结，子节点是元组。
+    '''
+    def parse(self, script):
+        return freeze_tree(self.prog(SimpleLexer().tokenize(script)))
+
+    '''
+    按分析表分析Token流，返回根节点
+    '''
+    def prog(self, tokens):
+        grammar = self.grammar
+        rows = grammar.rows
+        actions = grammar.action_functions
+        stack = [grammar.start_code]
+        values = []
+        token = tokens.peek()
+        column = token.get_type()._value_ if token != None else _EOF_COLUMN
+        last = None # 最近匹配的终结符
+        while stack:
+            symbol = stack.pop()
+            if symbol < 0:
+                actions[~symbol](values, last)
+            elif symbol >= _NONTERMINAL_BASE:
+                production = rows[symbol - _NONTERMINAL_BASE][column]
+                if production == None:
+                    raise Exception(self.unexpected(token, symbol - _NONTERMINAL_BASE))
+                stack.extend(production)
+            elif symbol == column:
+                last = tokens.read()
+                token = tokens.peek()
+                column = token.get_type()._value_ if token != None else _EOF_COLUMN
+            else:
+                raise Exception(self.describe(token) + ', expecting ' + TokenType(symbol).name)
+        if token != None:
+            raise Exception(self.describe(token) + ', expecting end of input')
+        return values[0]
+
+    # 出错时的报错：遇到了什么Token，这里可以是哪些Token
+    def unexpected(self, token, nonterminal):
+        row = self.grammar.rows[nonterminal]
+        expected = [member.name for member in TokenType if row[member.value] != None]
+        if row[_EOF_COLUMN] != None:
+            expected.append('end of input')
+        return self.describe(token) + ' in ' + self.grammar.nonterminals[nonterminal] + ', expecting ' + ' or '.join(expected)
+
+    def describe(self, token):
+        if token == None:
+            return 'unexpected end of input'
+        return 'unexpected ' + token.get_type().name + " '" + token.get_text() + "'"
+
+if __name__ == '__main__':
+    print(SCRIPT_GRAMMAR.format_table())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType
+
+'''
+表示槽位对应的变量还没有声明。变量声明了但没有赋值时，值是None。
+'''
+UNDECLARED = object()
+
+'''
+变量表。每个变量表有自己的变量名到槽位的映射，变量值按槽位存放在一个列表中，
+只为这个变量表中出现过的变量分配槽位，还没有声明的变量的值是UNDECLARED。
+同时提供按名字访问的接口（get、[]、in、keys、items），用法和原来的字典一样，看不到没有声明的变量。
+'''
+class SymbolTable(object):
+    def __init__(self):
+        self.slots = {}    # 变量名 -> 槽位
+        self.values = []
+
+    # 变量的槽位，没有槽位时分配一个，值是UNDECLARED
+    def slot(self, name):
+        slot = self.slots.get(name)
+        if slot == None:
+            slot = len(self.values)
+            self.slots[name] = slot
+            self.values.append(UNDECLARED)
+        return slot
+
+    '''
+    把一个语句的槽位（names的下标）对应到变量表的槽位。
+    求值时用values[binding[node.slot]]直接存取变量。
+    '''
+    def bind(self, names):
+        return [self.slot(name) for name in names]
+
+    def get(self, name, default=None):
+        slot = self.slots.get(name)
+        if slot == None or self.values[slot] is UNDECLARED:
+            return default
+        return self.values[slot]
+
+    def __getitem__(self, name):
+        value = self.values[self.slots[name]]
+        if value is UNDECLARED:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        self.values[self.slot(name)] = value
+
+    def __contains__(self, name):
+        slot = self.slots.get(name)
+        return slot != None and self.values[slot] is not UNDECLARED
+
+    def keys(self):
+        return [name for name, value in self.items()]
+
+    def items(self):
+        values = self.values
+        return [(name, values[slot]) for name, slot in self.slots.items() if values[slot] is not UNDECLARED]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.items())
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+'''
+一个语句（或者整个脚本）的名字解析结果。
+names：按槽位排列的变量名，槽位只在这个语句内有效，Programm节点的names是None；
+free_names：被读取或赋值、但之前没有被声明的变量；
+declared：语句执行完之后新声明的变量，不是变量声明语句时是None。
+'''
+class Resolution(object):
+    def __init__(self, names, free_names, declared=None):
+        self.names = names
+        self.free_names = free_names
+        self.declared = declared
+
+'''
+名字解析。
+以顶层语句为单位，给语句中的每个Identifier、AssignmentStmt、IntDeclaration节点分配一个整数槽位（node.slot），
+并找出自由变量，结果记在语句节点上（node.resolution）；Programm节点上记录整个脚本的自由变量。
+槽位只和这棵树有关，和变量表无关，所以ParseCache、IncrementalParser共享的AST也可以直接记录，
+同一个语句反复执行、出现在多棵树中时都只解析一次。
+自由变量必须已经在变量表中声明过，执行前用check()检查，未声明的变量在执行任何语句之前就报错。
+用显式的栈遍历，不递归。
+'''
+class NameResolver(object):
+    '''
+    解析root，root是Programm节点或者一个顶层语句。已经解析过的直接返回记录的结果。
+    '''
+    def resolve(self, root):
+        resolution = getattr(root, 'resolution', None)
+        if resolution != None:
+            return resolution
+        if root.get_type() != ASTNodeType.Programm:
+            return self.resolve_statement(root)
+        declared = set()
+        free_names = []
+        seen = set()
+        for statement in root.get_children():
+            resolution = getattr(statement, 'resolution', None)
+            if resolution == None:
+                resolution = self.resolve_statement(statement)
+            for name in resolution.free_names:
+                if name not in declared and name not in seen:
+                    free_names.append(name)
+                    seen.add(name)
+            if resolution.declared != None: # 声明在初始化表达式求值之后才生效
+                declared.add(resolution.declared)
+        root.resolution = Resolution(None, free_names)
+        return root.resolution
+
+    # 给一个语句中的变量分配槽位
+    def resolve_statement(self, statement):
+        names = []
+        slots = {}
+        free_names = []
+        seen = set()
+        declared = None
+        declaration = ASTNodeType.IntDeclaration
+        named = (ASTNodeType.Identifier, ASTNodeType.AssignmentStmt, declaration)
+        stack = [statement]
+        while stack:
+            node = stack.pop()
+            node_type = node.get_type()
+            if node_type in named:
+                name = node.get_text()
+                slot = slots.get(name)
+                if slot == None:
+                    slot = len(names)
+                    slots[name] = slot
+                    names.append(name)
+                node.slot = slot
+                if node_type is declaration:
+                    declared = name
+                elif name not in seen:
+                    free_names.append(name)
+                    seen.add(name)
+            stack.extend(node.get_children())
+        statement.resolution = Resolution(names, free_names, declared)
+        return statement.resolution
+
+    '''
+    检查自由变量是否都已经在变量表中声明过。
+    resolution可以是resolve()的结果，也可以是记录了free_names的编译结果。
+    '''
+    def check(self, resolution, symbols):
+        for name in resolution.free_names:
+            if name not in symbols:
+                raise Exception('unknown variable: ' + name)
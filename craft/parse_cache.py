@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.simple_parser import SimpleParser
+from play_with_compiler.craft.simple_calculator import SimpleASTNode, freeze_tree
+from collections import OrderedDict
+import sys
+
+'''
+一个AST节点对象占用的字节数（不含文本和子节点元组）。节点使用__slots__，没有__dict__。
+'''
+_NODE_BYTES = sys.getsizeof(SimpleASTNode(None, ''))
+
+'''
+把AST冻结成不可变的：每个节点的子节点列表换成元组，之后就不能再add_child()了。
+SimpleParser.parse返回的AST已经冻结，这里主要是估算字节数；叶子节点共用空元组，不计入。
+'''
+def freeze(node):
+    freeze_tree(node)
+    size = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        size += _NODE_BYTES + sys.getsizeof(node.text)
+        if node.children:
+            size += sys.getsizeof(node.children)
+            stack.extend(node.children)
+    return size
+
+'''
+SimpleParser.parse前面的LRU缓存，以脚本文本为键。
+同样的文本直接返回缓存中的AST，不再做词法分析和语法分析。
+返回的AST被多个调用者共享，已经冻结成不可变的。
+缓存同时受条目数和AST估算字节数的限制，超过任何一个都会淘汰最久没有用过的条目。
+'''
+class ParseCache(object):
+    def __init__(self, parser=None, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.parser = parser if parser != None else SimpleParser()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # 脚本文本 -> (AST, 估算字节数)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    '''
+    解析脚本，和SimpleParser.parse一样返回根节点。解析出错时不缓存，异常照常抛出。
+    '''
+    def parse(self, script):
+        entry = self.entries.get(script)
+        if entry != None:
+            self.hits += 1
+            self.entries.move_to_end(script)
+            return entry[0]
+
+        self.misses += 1
+        tree = self.parser.parse(script)
+        size = freeze(tree) + sys.getsizeof(script)
+        if size <= self.max_bytes:
+            self.entries[script] = (tree, size)
+            self.bytes += size
+            self.evict()
+        return tree
+
+    # 淘汰最久没有用过的条目，直到条目数和字节数都在限制之内
+    def evict(self):
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            script, (tree, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
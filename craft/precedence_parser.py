@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType, TokenType
+from play_with_compiler.craft.simple_parser import SimpleParser
+from play_with_compiler.craft.simple_calculator import SimpleASTNode
+
+'''
+二元运算符表：Token类型 -> (优先级, AST节点类型, 缺少右操作数时的报错)。优先级越大结合得越紧。
+增加一个运算符只需要在表里加一项。
+'''
+BINARY_OPERATORS = {
+    TokenType.GE: (1, ASTNodeType.Relational, 'invalid relational expression, expecting the right part.'),
+    TokenType.GT: (1, ASTNodeType.Relational, 'invalid relational expression, expecting the right part.'),
+    TokenType.EQ: (1, ASTNodeType.Relational, 'invalid relational expression, expecting the right part.'),
+    TokenType.LE: (1, ASTNodeType.Relational, 'invalid relational expression, expecting the right part.'),
+    TokenType.LT: (1, ASTNodeType.Relational, 'invalid relational expression, expecting the right part.'),
+    TokenType.Plus: (2, ASTNodeType.Additive, 'invlide additive expression, expecting the right part.'),
+    TokenType.Minus: (2, ASTNodeType.Additive, 'invlide additive expression, expecting the right part.'),
+    TokenType.Star: (3, ASTNodeType.Multiplicative, 'invalid multiplicative expression, expecting the right part.'),
+    TokenType.Slash: (3, ASTNodeType.Multiplicative, 'invalid multiplicative expression, expecting the right part.'),
+}
+
+'''
+ * 用运算符优先级解析表达式的语法解析器。
+ * 语句的解析和SimpleParser一样，表达式由一个循环按运算符表解析，所有运算符都是左结合的：
+ *
+ * expression -> primary (BinaryOp primary)*
+ * primary -> IntLiteral | Id | (expression)
+ * BinaryOp按优先级从低到高：关系运算（> >= == <= <）、加减、乘除
+ *
+ * SimpleParser的additive -> multiplicative -> primary每个操作数都要经过每一级优先级的函数调用，
+ * 这里每个操作数只调用一次primary()。不含关系运算的表达式，生成的AST和SimpleParser完全相同。
+'''
+class PrecedenceParser(SimpleParser):
+    '''
+    operators是二元运算符表，默认是BINARY_OPERATORS
+    '''
+    def __init__(self, predictive=True, operators=None):
+        SimpleParser.__init__(self, predictive)
+        self.operators = operators if operators != None else BINARY_OPERATORS
+
+    '''
+    SimpleParser中所有用到表达式的地方（语句、括号内）都调用additive()，这里换成按优先级解析
+    '''
+    def additive(self, tokens):
+        return self.expression(tokens)
+
+    '''
+    表达式。operands和pending是两个栈：读到一个运算符时，先把栈顶优先级不低于它的运算符
+    和它们的操作数归约成节点（相同优先级先归约，所以是左结合），再把它压栈。
+    '''
+    def expression(self, tokens):
+        node = self.primary(tokens)
+        if node == None:
+            return None
+        operators = self.operators
+        operands = [node]
+        pending = [] # 还没有归约的运算符：(优先级, 节点类型, 文本)
+        while True:
+            token = tokens.peek()
+            if token == None:
+                break
+            operator = operators.get(token.get_type())
+            if operator == None:
+                break
+            precedence = operator[0]
+            while pending and pending[-1][0] >= precedence:
+                self.reduce(operands, pending.pop())
+            text = tokens.read().get_text()
+            node = self.primary(tokens)
+            if node == None:
+                raise Exception(operator[2])
+            pending.append((precedence, operator[1], text))
+            operands.append(node)
+        while pending:
+            self.reduce(operands, pending.pop())
+        return operands[0]
+
+    # 把栈顶的两个操作数和运算符归约成一个节点
+    def reduce(self, operands, operator):
+        right = operands.pop()
+        node = SimpleASTNode(operator[1], operator[2])
+        node.add_children(operands[-1], right)
+        operands[-1] = node
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.simple_lexer import SimpleLexer, SimpleTokenReader, StreamTokenReader
+from play_with_compiler.craft.simple_parser import SimpleParser
+from play_with_compiler.craft.simple_calculator import SimpleASTNode, SimpleCalculator
+from play_with_compiler.craft.simple_script import SimpleScript
+from play_with_compiler.craft.base_type import TokenType
+import functools
+import json
+import sys
+import threading
+import time
+
+'''
+性能剖析。
+启用时把计时、计数的包装函数装到SimpleLexer、SimpleParser、SimpleScript等类的方法上，停用时恢复原来的方法，
+所以不启用时没有任何额外开销。
+包装的是类的方法，对所有实例都有效，所以同一时间只能有一个Profiler处于启用状态（由一个锁保证），
+并且只统计启用它的线程中的调用，其他线程（比如ScriptServer）的调用照常执行，不计入统计。
+不要在多线程共享的对象上使用，剖析单线程的程序。
+
+用法：
+    with Profiler() as profiler:
+        script.evaluate(SimpleParser().parse(code), '')
+    profiler.stats.dump()
+
+统计的内容：
+ * 各阶段的调用次数和耗时：lex（词法分析）、parse（语法分析）、evaluate（解释执行）、compile、run。
+   流式解析（parse_file）时，Token是在语法分析过程中逐块产生的，词法分析的时间计入parse。
+ * 产生的Token数、创建的AST节点数（包括回溯时丢弃的节点）。
+ * 回溯次数：回溯方式的语句解析中，表达式语句失败时set_position()的次数，和赋值语句失败时吐出标识符的unread()次数。
+   预测分析时预读第二个Token之后的unread()不是回溯，不计入。
+ * 按节点类型统计的求值次数，求值器每求出一个节点的值计一次，出错时没有求值的节点不计入。
+'''
+
+'''
+剖析的结果
+'''
+class ProfileStats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.phases = {}            # 阶段名 -> [调用次数, 秒数]
+        self.tokens = 0
+        self.nodes_created = 0
+        self.set_position_calls = 0
+        self.unread_calls = 0
+        self.evaluated = {}         # 节点类型名 -> 求值次数
+
+    @property
+    def backtracks(self):
+        return self.set_position_calls + self.unread_calls
+
+    def add_phase(self, name, seconds):
+        phase = self.phases.get(name)
+        if phase == None:
+            phase = [0, 0.0]
+            self.phases[name] = phase
+        phase[0] += 1
+        phase[1] += seconds
+
+    def to_dict(self):
+        return {
+            'phases': dict((name, {'calls': calls, 'seconds': seconds})
+                           for name, (calls, seconds) in self.phases.items()),
+            'tokens': self.tokens,
+            'nodes_created': self.nodes_created,
+            'backtracks': self.backtracks,
+            'set_position_calls': self.set_position_calls,
+            'unread_calls': self.unread_calls,
+            'evaluated': dict(self.evaluated),
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent, sort_keys=True)
+
+    def dump(self, file=sys.stderr):
+        print(self.to_json(), file=file)
+
+# 当前启用的Profiler
+_active = None
+
+# 启用Profiler时持有的锁，保证同一时间只有一个Profiler修改类的方法
+_lock = threading.Lock()
+
+class Profiler(object):
+    def __init__(self, stats=None):
+        self.stats = stats if stats != None else ProfileStats()
+        self.patches = [] # (类, 方法名, 原来的方法)
+        self.thread = None # 启用Profiler的线程，只统计这个线程中的调用
+
+    def enable(self):
+        global _active
+        if _active is self:
+            return
+        if not _lock.acquire(blocking=False):
+            raise Exception('another profiler is already enabled')
+        _active = self
+        self.thread = threading.get_ident()
+
+        self.patch(SimpleLexer, 'tokenize', self.timed('lex', self.count_tokens))
+        self.patch(SimpleLexer, 'tokenize_file', self.timed('lex', self.count_tokens))
+        self.patch(SimpleLexer, 'iter_tokens', self.counted_iter_tokens)
+        self.patch(SimpleParser, 'prog', self.timed('parse'))
+        self.patch(SimpleCalculator, 'prog', self.timed('parse'))
+        self.patch(SimpleScript, 'evaluate', self.timed('evaluate'))
+        self.patch(SimpleCalculator, '_evaluate', self.timed('evaluate'))
+        self.hook(SimpleScript, 'trace', self.count_evaluated)
+        self.hook(SimpleCalculator, 'trace', self.count_evaluated)
+        self.patch(SimpleScript, 'compile', self.timed('compile'))
+        self.patch(SimpleScript, 'run', self.timed('run'))
+
+        # set_position()只在回溯方式的表达式语句失败时调用
+        for reader_class in (SimpleTokenReader, StreamTokenReader):
+            self.patch(reader_class, 'set_position', self.counted('set_position_calls'))
+        self.patch(SimpleParser, 'assignment_statement', self.counted_assignment)
+        self.patch(SimpleASTNode, '__init__', self.counted('nodes_created'))
+
+    def disable(self):
+        global _active
+        for owner, name, original in reversed(self.patches):
+            setattr(owner, name, original)
+        self.patches = []
+        if _active is self:
+            _active = None
+            self.thread = None
+            _lock.release()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *args):
+        self.disable()
+
+    # 把owner.name换成wrap(原来的方法)生成的包装函数
+    def patch(self, owner, name, wrap):
+        original = owner.__dict__[name]
+        self.patches.append((owner, name, original))
+        setattr(owner, name, functools.wraps(original)(wrap(original)))
+
+    # 把owner.name（平时是None的钩子）换成function
+    def hook(self, owner, name, function):
+        self.patches.append((owner, name, owner.__dict__[name]))
+        setattr(owner, name, staticmethod(function))
+
+    # 是否是启用Profiler的线程中的调用
+    def profiling(self):
+        return threading.get_ident() == self.thread
+
+    '''
+    计时的包装函数。after(self, result)在调用之后统计结果
+    '''
+    def timed(self, phase, after=None):
+        stats = self.stats
+        def wrap(original):
+            def wrapper(obj, *args, **kwargs):
+                if not self.profiling():
+                    return original(obj, *args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    result = original(obj, *args, **kwargs)
+                finally:
+                    stats.add_phase(phase, time.perf_counter() - start)
+                if after != None:
+                    after(obj, result)
+                return result
+            return wrapper
+        return wrap
+
+    # 计数的包装函数，每调用一次stats的counter属性加一
+    def counted(self, counter):
+        stats = self.stats
+        def wrap(original):
+            def wrapper(*args, **kwargs):
+                if self.profiling():
+                    setattr(stats, counter, getattr(stats, counter) + 1)
+                return original(*args, **kwargs)
+            return wrapper
+        return wrap
+
+    # 流式词法分析时，逐个统计产生的Token
+    def counted_iter_tokens(self, original):
+        stats = self.stats
+        def wrapper(*args, **kwargs):
+            if not self.profiling():
+                yield from original(*args, **kwargs)
+                return
+            for token in original(*args, **kwargs):
+                stats.tokens += 1
+                yield token
+        return wrapper
+
+    # 回溯方式下，赋值语句读入标识符后发现后面不是等号，用unread()吐出标识符，返回None
+    def counted_assignment(self, original):
+        stats = self.stats
+        def wrapper(parser, tokens):
+            token = tokens.peek()
+            node = original(parser, tokens)
+            if node == None and token != None and token.get_type() == TokenType.Identifier and self.profiling():
+                stats.unread_calls += 1
+            return node
+        return wrapper
+
+    # tokenize之后，Token都已经在lexer.tokens中
+    def count_tokens(self, lexer, reader):
+        self.stats.tokens += len(lexer.tokens)
+
+    # 求值器每求出一个节点的值调用一次，按类型统计
+    def count_evaluated(self, node):
+        if self.profiling():
+            evaluated = self.stats.evaluated
+            name = node.get_type().name
+            evaluated[name] = evaluated.get(name, 0) + 1
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType
+from play_with_compiler.craft.script_vm import VMCompiler
+
+'''
+响应式求值：同一段脚本被反复修改、反复求值时，只重新执行受影响的语句。
+每次update()都相当于在初始变量上从头执行一遍脚本，结果和SimpleScript.evaluate(root, '')相同，
+但是记住每个语句上一次执行时读到的变量值、写入的值和结果。
+每次update()先建立语句之间的依赖图，找出变化了的语句：新的语句（IncrementalParser会复用没有修改的语句节点）、
+上次执行出错的语句，以及读取的变量改由别的语句写入的语句（前面插入或删除了语句）。
+然后只访问依赖图中受它们影响的语句，其他语句直接使用上次的结果。受影响的语句如果读到的值都和上次一样，
+也不重新执行，所以重新执行后写入的值没有变时，后面的语句就不受影响。
+
+用法：
+    script = ReactiveScript()
+    script.update(IncrementalParser().parse(code).root)
+    ...
+    script.update(state.root)
+    script.executed, script.skipped
+'''
+
+'''
+表示变量还没有声明
+'''
+_MISSING = object()
+
+# 上次读到的值和这次的值是否相同。1和1.0、True和1都算不同
+def _same(a, b):
+    return a is b or (type(a) is type(b) and a == b)
+
+'''
+一个语句的记录：它读取的变量、写入的变量，以及上一次执行的情况
+'''
+class StatementRecord(object):
+    def __init__(self, node):
+        self.node = node
+        self.target = None      # 声明或赋值的变量，表达式语句是None
+        self.reads = []         # 读取的变量，不重复
+        self.names = []         # 按NameResolver的遍历顺序出现的变量名（Identifier和赋值的目标），用于检查自由变量
+        self.program = None     # 编译好的字节码，第一次执行时才编译
+        self.inputs = None      # 上一次执行时读到的变量值，None表示还没有成功执行过
+        self.sources = None     # 上一次执行时读取的变量分别是哪个语句节点写入的，见DependencyGraph.sources
+        self.written = None     # 上一次执行后target的值
+        self.result = None      # 上一次执行的结果
+
+        node_type = node.get_type()
+        if node_type == ASTNodeType.IntDeclaration or node_type == ASTNodeType.AssignmentStmt:
+            self.target = node.get_text()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            current_type = current.get_type()
+            if current_type == ASTNodeType.Identifier:
+                self.names.append(current.get_text())
+                if current.get_text() not in self.reads:
+                    self.reads.append(current.get_text())
+            elif current_type == ASTNodeType.AssignmentStmt:
+                self.names.append(current.get_text())
+            stack.extend(current.get_children())
+
+'''
+语句之间的依赖图：每个语句读取哪些变量，这些变量的值是哪个语句写入的。
+'''
+class DependencyGraph(object):
+    def __init__(self, records):
+        self.records = records
+        self.writers = []       # 第i个语句读取的每个变量 -> 写入它的语句的序号，-1表示初始变量
+        self.previous = []      # 第i个语句写入的变量在它之前是哪个语句写入的，-1表示初始变量
+        self.readers = [[] for record in records] # 第i个语句写入的值被哪些语句读取
+        last_writer = {}
+        for index, record in enumerate(records):
+            writers = {}
+            for name in record.reads:
+                writer = last_writer.get(name, -1)
+                writers[name] = writer
+                if writer >= 0:
+                    self.readers[writer].append(index)
+            self.writers.append(writers)
+            if record.target != None:
+                self.previous.append(last_writer.get(record.target, -1))
+                last_writer[record.target] = index
+            else:
+                self.previous.append(-1)
+
+    # 第index个语句读取的变量是由哪些语句节点写入的，None表示初始变量
+    def sources(self, index):
+        records = self.records
+        return [records[writer].node if writer >= 0 else None for writer in self.writers[index].values()]
+
+    '''
+    修改了changed中的语句后，可能受影响的所有语句的序号（包括changed本身），按顺序排列
+    '''
+    def affected(self, changed):
+        result = set(changed)
+        stack = list(changed)
+        while stack:
+            for reader in self.readers[stack.pop()]:
+                if reader not in result:
+                    result.add(reader)
+                    stack.append(reader)
+        return sorted(result)
+
+class ReactiveScript(object):
+    '''
+    variables是每次执行开始时的初始变量
+    '''
+    def __init__(self, variables=None):
+        self.initial = dict(variables) if variables != None else {}
+        self.records = {}       # 语句节点 -> StatementRecord
+        self.graph = None       # 最近一次update()的依赖图
+        self.variables = {}     # 最近一次update()执行后的变量
+        self.results = []       # 最近一次update()中每个语句的结果
+        self.executed = 0       # 最近一次update()中重新执行的语句数
+        self.skipped = 0        # 最近一次update()中直接使用上次结果的语句数
+        self.total_executed = 0
+        self.total_skipped = 0
+
+    '''
+    在初始变量上执行root，返回最后一个语句的值。echo为True时和evaluate(root, '')一样打印每个语句的结果。
+    '''
+    def update(self, root, echo=False):
+        statements = root.get_children() if root.get_type() == ASTNodeType.Programm else [root]
+        records = []
+        for statement in statements:
+            record = self.records.get(statement)
+            if record == None:
+                record = StatementRecord(statement)
+            records.append(record)
+        self.records = dict((record.node, record) for record in records) # 不再出现的语句被丢弃
+        graph = DependencyGraph(records)
+        self.graph = graph
+
+        self.executed = 0
+        failed = 0 # 检查没有通过时，一个语句也没有执行
+        try:
+            self.check(records)
+            changed = [index for index, record in enumerate(records)
+                       if record.inputs == None or record.sources != graph.sources(index)]
+            for index in graph.affected(changed):
+                failed = index
+                record = records[index]
+                inputs = {}
+                for name, writer in graph.writers[index].items():
+                    inputs[name] = self.value(records, writer, name)
+                if record.inputs == None or not self.unchanged(record, inputs):
+                    self.execute(record, inputs, self.value(records, graph.previous[index], record.target))
+                    self.executed += 1
+                record.sources = graph.sources(index)
+            failed = None
+        finally:
+            if failed != None: # 出错的语句之前的语句都已经执行过，和SimpleScript一样输出它们的结果
+                records = records[:failed]
+            self.skipped = len(records) - self.executed
+            self.total_executed += self.executed
+            self.total_skipped += self.skipped
+            self.results = [record.result for record in records]
+            self.variables = dict(self.initial)
+            for record in records:
+                if record.target != None:
+                    self.variables[record.target] = record.written
+            if echo:
+                for record in records:
+                    if record.target != None:
+                        print('%s: %s' %(record.target, record.result))
+                    else:
+                        print(record.result)
+        return self.results[-1] if self.results else None
+
+    # writer写入的变量name的值，writer是-1时是初始变量
+    def value(self, records, writer, name):
+        if writer >= 0:
+            return records[writer].written
+        return self.initial.get(name, _MISSING)
+
+    '''
+    和NameResolver一样，在执行任何语句之前检查是否使用了未声明的变量
+    '''
+    def check(self, records):
+        declared = set()
+        for record in records:
+            for name in record.names:
+                if name not in declared and name not in self.initial:
+                    raise Exception('unknown variable: ' + name)
+            if record.node.get_type() == ASTNodeType.IntDeclaration:
+                declared.add(record.target)
+
+    # 语句读取的变量是否都和上次执行时一样
+    def unchanged(self, record, inputs):
+        previous = record.inputs
+        for name in record.reads:
+            if not _same(inputs[name], previous[name]):
+                return False
+        return True
+
+    '''
+    执行一个语句，记下读到的值、写入的值和结果。
+    inputs是语句读取的变量的值，current是它写入的变量原来的值。
+    '''
+    def execute(self, record, inputs, current):
+        record.inputs = None # 执行出错时，这个记录就不再有效
+        variables = dict((name, value) for name, value in inputs.items() if value is not _MISSING)
+        if record.target != None and current is not _MISSING:
+            variables[record.target] = current
+        if record.program == None:
+            record.program = VMCompiler().compile(record.node)
+        record.result = record.program.run(variables, False)
+        if record.target != None:
+            record.written = variables[record.target]
+        record.inputs = inputs
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType, TokenType
+from play_with_compiler.craft.simple_parser import SimpleParser
+from play_with_compiler.craft.simple_calculator import freeze_tree
+from play_with_compiler.craft.ast_optimizer import ASTOptimizer
+from play_with_compiler.craft.flat_ast import FlatAST, MAGIC
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+
+'''
+磁盘上的脚本缓存，类似Python的.pyc。
+服务每次启动都要重新解析同样的库脚本，这里把解析（和可选的优化）的结果用FlatAST的二进制格式存到目录里，
+下次启动时直接读出来还原成SimpleASTNode树，不再做词法分析和语法分析。
+
+ * 文件名是键的SHA-256：源代码、语法版本、解析器、是否优化。源代码或者语法变了，键就不同，旧的文件不会被误用。
+ * 写文件是原子的：先写到同一目录下的临时文件，再os.replace()改名，其他进程不会读到写了一半的文件。
+ * 目录的总大小超过max_bytes时，按最后使用时间（文件的修改时间，命中时更新）淘汰最久没有用过的文件。
+ * 文件的末尾是内容的CRC32校验和。读到损坏或者被截断的文件时把它删掉，当作没有命中，重新解析。
+
+用法：
+    cache = ScriptCache('/var/cache/pwc')
+    tree = cache.parse(script)
+    tree = cache.parse_file('lib.play')
+'''
+
+'''
+语法版本。修改了语法、AST节点类型或者解析的结果时要加一，让以前的缓存全部失效。
+'''
+GRAMMAR_VERSION = 2
+
+# 缓存文件的扩展名
+_SUFFIX = '.ast'
+
+# 缓存文件末尾的校验和：FlatAST二进制数据的CRC32
+_CHECKSUM = struct.Struct('<I')
+
+# 缓存文件的格式版本，改变了文件的布局（比如校验和）时加一
+_FILE_VERSION = 2
+
+# 键里除了源代码以外的部分：语法版本、缓存文件和FlatAST的格式、Token和节点类型的定义
+_GRAMMAR_KEY = '\0'.join([str(GRAMMAR_VERSION), str(_FILE_VERSION), MAGIC.decode('ascii'),
+                          ','.join(TokenType.__members__), ','.join(ASTNodeType.__members__)]).encode('utf-8')
+
+'''
+解析器的标识：类名，LL1Parser还要加上文法的产生式。不同的解析器对同一段脚本生成的AST可能不同，不能共用缓存文件。
+'''
+def _parser_key(parser):
+    key = type(parser).__name__
+    grammar = getattr(parser, 'grammar', None)
+    if grammar != None:
+        key += '\0' + repr(grammar.productions)
+    return key.encode('utf-8')
+
+class ScriptCache(object):
+    '''
+    directory：缓存目录，不存在时自动创建。
+    optimize为True时缓存的是ASTOptimizer优化过的AST。
+    '''
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, optimize=False, parser=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.optimize = optimize
+        self.parser = parser if parser != None else SimpleParser()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0   # 损坏而被删掉的文件
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, script):
+        digest = hashlib.sha256(_GRAMMAR_KEY)
+        digest.update(b'\0' + _parser_key(self.parser))
+        digest.update(b'\0O' if self.optimize else b'\0-')
+        digest.update(script.encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, script):
+        return os.path.join(self.directory, self.key(script) + _SUFFIX)
+
+    '''
+    解析脚本，和SimpleParser.parse一样返回冻结的根节点。解析出错时不缓存，异常照常抛出。
+    '''
+    def parse(self, script):
+        path = self.path(script)
+        tree = self.read(path)
+        if tree != None:
+            self.hits += 1
+            return tree
+
+        self.misses += 1
+        tree = self.parser.parse(script)
+        if self.optimize:
+            tree = freeze_tree(ASTOptimizer().optimize(tree))
+        data = FlatAST.from_tree(tree).to_bytes()
+        self.write(path, data + _CHECKSUM.pack(zlib.crc32(data)))
+        return tree
+
+    def parse_file(self, path):
+        with open(path, 'r', encoding='utf-8') as file:
+            return self.parse(file.read())
+
+    # 读缓存文件，没有或者读不出来时返回None；损坏的文件被删掉
+    def read(self, path):
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        try:
+            tree = self.decode(data)
+        except Exception:
+            tree = None
+        if tree == None:
+            self.errors += 1
+            self.remove(path)
+            return None
+        try:
+            os.utime(path) # 记录最后使用的时间，淘汰时用
+        except OSError:
+            pass
+        return freeze_tree(tree)
+
+    # 检查校验和，还原成AST
+    def decode(self, data):
+        if len(data) < _CHECKSUM.size:
+            return None
+        data = memoryview(data)
+        content = data[:-_CHECKSUM.size]
+        if _CHECKSUM.unpack(data[-_CHECKSUM.size:])[0] != zlib.crc32(content):
+            return None
+        return FlatAST.from_bytes(content).to_tree()
+
+    # 原子地写入缓存文件，然后检查目录的大小
+    def write(self, path, data):
+        if len(data) > self.max_bytes:
+            return
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp, path)
+        except OSError:
+            self.remove(temp)
+            return
+        self.writes += 1
+        self.evict()
+
+    '''
+    淘汰最久没有用过的文件，直到目录中缓存文件的总大小不超过max_bytes
+    '''
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError: # 被其他进程删掉了
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if self.remove(path):
+                self.evictions += 1
+            total -= size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    # 删除目录中所有的缓存文件
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(_SUFFIX):
+                self.remove(entry.path)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'errors': self.errors,
+        }
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType, RELATIONAL_OPERATORS
+from operator import itemgetter, add, sub, mul, truediv
+
+'''
+表示变量还没有声明。变量声明了但没有赋值时，值是None。
+'''
+_MISSING = object()
+
+'''
+二元运算节点的类型 -> {运算符: 运算}
+'''
+_OPERATIONS = {
+    ASTNodeType.Additive: {'+': add, '-': sub},
+    ASTNodeType.Multiplicative: {'*': mul, '/': truediv},
+    ASTNodeType.Relational: RELATIONAL_OPERATORS,
+}
+
+# 左操作数是除法的结果时，先取整再运算
+def _truncate_left(operation):
+    return lambda left, right: operation(int(left), right)
+
+'''
+编译好的脚本。
+每个变量在编译时分配了一个槽位，执行时变量值存放在列表中，不再按名字查字典；
+每个语句是一个预先绑定好子节点的闭包，执行时不再判断节点类型。
+'''
+class CompiledScript(object):
+    def __init__(self, names, statements):
+        self.names = names            # 槽位对应的变量名
+        self.statements = statements  # [(闭包, 变量名)]，表达式语句的变量名是None
+
+    '''
+    在variables（变量名到值的字典）上执行脚本，返回最后一个语句的值。
+    echo为True时，和SimpleScript.evaluate(node, '')一样打印每个语句的结果。
+    即使中途出错，已经执行的语句对变量的修改也会写回variables。
+    '''
+    def run(self, variables, echo=True):
+        slots = [variables.get(name, _MISSING) for name in self.names]
+        result = None
+        try:
+            for statement, var_name in self.statements:
+                result = statement(slots)
+                if echo:
+                    if var_name != None:
+                        print('%s: %s' %(var_name, result))
+                    else:
+                        print(result)
+        finally:
+            for name, value in zip(self.names, slots):
+                if value is not _MISSING:
+                    variables[name] = value
+        return result
+
+'''
+把SimpleParser生成的AST编译成闭包。
+求值规则与SimpleScript.evaluate完全一致，包括除法得到浮点数、参与下一步运算时再取整。
+'''
+class ScriptCompiler(object):
+    def __init__(self):
+        self.slots = {}         # 变量名 -> 槽位
+        self.declared = set()   # 编译到当前位置时，肯定已经声明过的变量
+        self.assigned = set()   # 编译到当前位置时，肯定已经有整数值的变量
+
+    def compile(self, node):
+        statements = []
+        children = node.get_children() if node.get_type() == ASTNodeType.Programm else [node]
+        for child in children:
+            node_type = child.get_type()
+            if node_type == ASTNodeType.IntDeclaration or node_type == ASTNodeType.AssignmentStmt:
+                statements.append((self.compile_assignment(child), child.get_text()))
+            else:
+                statements.append((self.compile_expression(child), None))
+        names = [None] * len(self.slots)
+        for name, slot in self.slots.items():
+            names[slot] = name
+        return CompiledScript(names, statements)
+
+    # 变量的槽位，第一次遇到时分配
+    def slot(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.slots)
+        return self.slots[name]
+
+    '''
+    变量声明和赋值语句
+    '''
+    def compile_assignment(self, node):
+        var_name = node.get_text()
+        slot = self.slot(var_name)
+        check = node.get_type() == ASTNodeType.AssignmentStmt and var_name not in self.declared
+        expression = None
+        if len(node.get_children()) > 0:
+            expression = self.compile_expression(node.get_children()[0])
+
+        if node.get_type() == ASTNodeType.IntDeclaration:
+            self.declared.add(var_name)
+        if expression == None:
+            self.assigned.discard(var_name)
+            def declare(slots):
+                slots[slot] = None
+                return None
+            return declare
+        self.assigned.add(var_name)
+
+        if check:
+            def checked_assign(slots):
+                if slots[slot] is _MISSING:
+                    raise Exception('unknown variable: ' + var_name)
+                result = expression(slots)
+                slots[slot] = int(result)
+                return result
+            return checked_assign
+
+        def assign(slots):
+            result = expression(slots)
+            slots[slot] = int(result)
+            return result
+        return assign
+
+    '''
+    表达式。每个节点编译成一个以槽位列表为参数的闭包。
+    SimpleParser生成的左结合的运算链（比如1+2+...+n）是一棵向左延伸的深树，
+    沿左子节点向下找到链的起点，整条链编译成一个闭包，按顺序循环执行每一步的(运算, 右操作数)，
+    这样编译和执行都不递归，很长的表达式也不会超过Python的递归深度限制。链上只有一个运算时直接用一个闭包。
+    '''
+    def compile_expression(self, node):
+        node_type = node.get_type()
+        if node_type == ASTNodeType.IntLiteral:
+            value = int(node.get_text())
+            return lambda slots: value
+        if node_type == ASTNodeType.Identifier:
+            return self.compile_identifier(node.get_text())
+        if node_type not in _OPERATIONS:
+            raise Exception('unsupported node: ' + str(node_type))
+
+        chain = []
+        while node.get_type() in _OPERATIONS:
+            chain.append(node)
+            node = node.get_children()[0]
+        if len(chain) == 1:
+            return self.compile_binary(chain[0])
+
+        first = self.compile_operand(node)
+        steps = []
+        truncate = False # 前一步是除法，结果参与这一步运算之前要取整
+        for node in reversed(chain):
+            operation = _OPERATIONS[node.get_type()][node.get_text()]
+            if truncate:
+                operation = _truncate_left(operation)
+            steps.append((operation, self.compile_operand(node.get_children()[1])))
+            truncate = node.get_type() == ASTNodeType.Multiplicative and node.get_text() != '*'
+        steps = tuple(steps)
+        def run_chain(slots):
+            value = first(slots)
+            for operation, right in steps:
+                value = operation(value, right(slots))
+            return value
+        return run_chain
+
+    # 一个二元运算节点
+    def compile_binary(self, node):
+        node_type = node.get_type()
+        children = node.get_children()
+        left = self.compile_operand(children[0])
+        right = self.compile_operand(children[1])
+        if node_type == ASTNodeType.Additive:
+            if node.get_text() == '+':
+                return lambda slots: left(slots) + right(slots)
+            return lambda slots: left(slots) - right(slots)
+        if node_type == ASTNodeType.Multiplicative:
+            if node.get_text() == '*':
+                return lambda slots: left(slots) * right(slots)
+            return lambda slots: left(slots) / right(slots)
+        compare = RELATIONAL_OPERATORS[node.get_text()]
+        return lambda slots: compare(left(slots), right(slots))
+
+    '''
+    二元运算的操作数。evaluate对操作数都要做int()，但只有除法的结果不是整数，
+    所以只给除法的结果加上取整。
+    '''
+    def compile_operand(self, node):
+        operand = self.compile_expression(node)
+        if node.get_type() == ASTNodeType.Multiplicative and node.get_text() != '*':
+            return lambda slots: int(operand(slots))
+        return operand
+
+    '''
+    读取变量。如果编译时已经能确定变量有值，直接按槽位取值，否则执行时要检查。
+    '''
+    def compile_identifier(self, var_name):
+        slot = self.slot(var_name)
+        if var_name in self.assigned:
+            return itemgetter(slot)
+        def load(slots):
+            value = slots[slot]
+            if value is None or value is _MISSING:
+                raise Exception('variavle ' + var_name + ' has not been set any value')
+            return value
+        return load
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.simple_script import SimpleScript
+from play_with_compiler.craft.parse_cache import ParseCache
+from collections import deque
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import sys
+import time
+
+'''
+在一个进程里为很多用户提供脚本解释服务，每个连接是一个会话，有自己的SimpleScript变量表。
+
+协议是按行的：客户端每次发送一行脚本，和REPL一样，以分号结尾的行才会和之前积累的行一起执行。
+服务器对每一行回复一行JSON：
+    {"output": "a: 1\n", "error": null}   执行了脚本，output是打印的内容，出错时error是错误信息
+    {"pending": true}                      这一行没有以分号结尾，等待后续的行
+    {"stats": {...}}                       收到":stats"时返回服务器的统计信息
+    {"bye": true}                          收到"exit();"，之后关闭连接
+
+每个会话的请求先放进一个有界队列，由这个会话自己的任务依次执行。队列满了就暂停读取这个连接，
+TCP的流量控制会让客户端的发送也慢下来（背压）；回复时等待写缓冲区排空，客户端不读回复时同样会停下来。
+脚本的执行是同步的，执行完一个请求就让出事件循环，各个会话轮流执行。
+
+用法：
+    python -m play_with_compiler.craft.script_server serve --port 8765
+    python -m play_with_compiler.craft.script_server serve --unix /tmp/pwc.sock
+    python -m play_with_compiler.craft.script_server load --port 8765 --sessions 100 --requests 1000
+'''
+
+'''
+服务器的统计信息。延迟从读到请求开始，到回复写完为止，包括排队的时间。
+'''
+class ServerStats(object):
+    def __init__(self, samples=10000):
+        self.started = time.perf_counter()
+        self.sessions_opened = 0
+        self.sessions_active = 0
+        self.sessions_rejected = 0
+        self.requests = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.evaluate_seconds = 0.0
+        self.latencies = deque(maxlen=samples) # 最近的请求延迟，用来计算百分位数
+
+    def record(self, latency, evaluate_seconds, error):
+        self.requests += 1
+        self.evaluate_seconds += evaluate_seconds
+        if error:
+            self.errors += 1
+        self.latencies.append(latency)
+
+    def to_dict(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            'uptime_seconds': seconds,
+            'sessions_opened': self.sessions_opened,
+            'sessions_active': self.sessions_active,
+            'sessions_rejected': self.sessions_rejected,
+            'requests': self.requests,
+            'errors': self.errors,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'requests_per_second': self.requests / seconds if seconds > 0 else 0.0,
+            'evaluate_seconds': self.evaluate_seconds,
+            'latency_ms': latency_summary(self.latencies),
+        }
+
+# 延迟的百分位数，单位是毫秒
+def latency_summary(latencies):
+    if not latencies:
+        return {}
+    values = sorted(latencies)
+    def percentile(p):
+        return values[min(len(values) - 1, int(len(values) * p))] * 1000
+    return {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99), 'max': values[-1] * 1000}
+
+'''
+一个会话：变量表和还没有执行的行
+'''
+class Session(object):
+    def __init__(self):
+        self.script = SimpleScript(False)
+        self.pending = ''
+
+class ScriptServer(object):
+    '''
+    queue_size：每个会话最多排队的请求数。
+    max_sessions：同时存在的会话数上限，超过时新的连接收到一个错误后被关闭。
+    max_line：一行的最大字节数；max_pending：积累的未执行脚本的最大字符数。
+    '''
+    def __init__(self, queue_size=16, max_sessions=1000, max_line=64 * 1024, max_pending=1024 * 1024):
+        self.queue_size = queue_size
+        self.max_sessions = max_sessions
+        self.max_line = max_line
+        self.max_pending = max_pending
+        self.cache = ParseCache() # 所有会话共享，AST是冻结的
+        self.stats = ServerStats()
+
+    async def start(self, host='127.0.0.1', port=8765, unix=None):
+        if unix != None:
+            return await asyncio.start_unix_server(self.handle, path=unix, limit=self.max_line)
+        return await asyncio.start_server(self.handle, host, port, limit=self.max_line)
+
+    '''
+    一个连接：读取请求放入队列，由serve_session执行
+    '''
+    async def handle(self, reader, writer):
+        if self.stats.sessions_active >= self.max_sessions:
+            self.stats.sessions_rejected += 1
+            await self.send(writer, {'error': 'too many sessions'})
+            writer.close()
+            return
+        self.stats.sessions_opened += 1
+        self.stats.sessions_active += 1
+        queue = asyncio.Queue(self.queue_size)
+        worker = asyncio.ensure_future(self.serve_session(Session(), queue, writer))
+        try:
+            while not worker.done():
+                try:
+                    line = await reader.readline()
+                except ValueError: # 一行超过了max_line
+                    await self.enqueue(queue, (time.perf_counter(), None), worker)
+                    break
+                if not line:
+                    break
+                self.stats.bytes_in += len(line)
+                await self.enqueue(queue, (time.perf_counter(), line.decode('utf-8', 'replace').rstrip('\r\n')), worker)
+        except ConnectionError:
+            pass
+        finally:
+            await self.enqueue(queue, None, worker)
+            await worker
+            self.stats.sessions_active -= 1
+            writer.close()
+
+    '''
+    把请求放入队列，队列满时等待。会话的任务已经结束时（客户端退出或者连接出错）不再等待。
+    '''
+    async def enqueue(self, queue, item, worker):
+        if worker.done():
+            return
+        try:
+            queue.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            pass
+        put = asyncio.ensure_future(queue.put(item))
+        await asyncio.wait([put, worker], return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+
+    # 依次执行一个会话的请求
+    async def serve_session(self, session, queue, writer):
+        while True:
+            item = await queue.get()
+            if item == None:
+                return
+            received, line = item
+            if line == None:
+                response = {'error': 'line too long'}
+            else:
+                response = self.execute(session, line)
+            seconds = response.pop('seconds', 0.0)
+            try:
+                await self.send(writer, response)
+            except ConnectionError:
+                return
+            self.stats.record(time.perf_counter() - received, seconds, response.get('error'))
+            if line == None or 'bye' in response:
+                writer.close() # 读取请求的循环随之结束
+                return
+            await asyncio.sleep(0) # 让其他会话也有机会执行
+
+    async def send(self, writer, response):
+        data = (json.dumps(response) + '\n').encode('utf-8')
+        self.stats.bytes_out += len(data)
+        writer.write(data)
+        await writer.drain()
+
+    '''
+    执行一行请求，返回回复的内容。seconds是执行脚本用的时间，不发给客户端。
+    '''
+    def execute(self, session, line):
+        if line == ':stats':
+            return {'stats': self.stats.to_dict()}
+        if line == 'exit();':
+            return {'bye': True}
+        session.pending += line + '\n'
+        if len(session.pending) > self.max_pending:
+            session.pending = ''
+            return {'output': '', 'error': 'script too long'}
+        if not line.endswith(';'):
+            return {'pending': True}
+
+        script_text = session.pending
+        session.pending = ''
+        output = io.StringIO()
+        error = None
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(output):
+                session.script.evaluate(self.cache.parse(script_text), '')
+        except Exception as e:
+            error = str(e)
+        return {'output': output.getvalue(), 'error': error, 'seconds': time.perf_counter() - start}
+
+async def serve(options):
+    server = ScriptServer(options.queue_size, options.max_sessions)
+    listener = await server.start(options.host, options.port, options.unix)
+    print('listening on {}'.format(options.unix or '{}:{}'.format(options.host, options.port)), file=sys.stderr)
+    try:
+        await listener.serve_forever()
+    finally:
+        print(json.dumps(server.stats.to_dict(), indent=2), file=sys.stderr)
+
+'''
+压力测试客户端：sessions个会话并发，每个会话发送requests个请求，最多window个请求在途（流水线）。
+返回统计结果的字典。
+'''
+async def load(host='127.0.0.1', port=8765, unix=None, sessions=100, requests=1000, window=8):
+    latencies = []
+    errors = [0]
+
+    async def run_session(index):
+        if unix != None:
+            reader, writer = await asyncio.open_unix_connection(unix)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        lines = ['int x = {};'.format(index)]
+        for i in range(1, requests):
+            lines.append('x = x * 3 / 2 - x / 2 + {};'.format(i % 7) if i % 4 else 'x + {};'.format(i))
+        sent = deque()
+        slots = asyncio.Semaphore(window)
+
+        async def send_all():
+            for line in lines:
+                await slots.acquire()
+                sent.append(time.perf_counter())
+                writer.write((line + '\n').encode('utf-8'))
+                await writer.drain()
+
+        sender = asyncio.ensure_future(send_all())
+        for i in range(len(lines)):
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent.popleft())
+            if response.get('error'):
+                errors[0] += 1
+            slots.release()
+        await sender
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_session(i) for i in range(sessions)])
+    seconds = time.perf_counter() - start
+    return {
+        'sessions': sessions,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds if seconds > 0 else 0.0,
+        'latency_ms': latency_summary(latencies),
+    }
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Script evaluation server')
+    subparsers = parser.add_subparsers(dest='command')
+    for name in ('serve', 'load'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('--host', default='127.0.0.1')
+        sub.add_argument('--port', type=int, default=8765)
+        sub.add_argument('--unix', default=None, help='unix socket path, instead of TCP')
+        if name == 'serve':
+            sub.add_argument('--queue-size', type=int, default=16, help='queued requests per session')
+            sub.add_argument('--max-sessions', type=int, default=1000)
+        else:
+            sub.add_argument('--sessions', type=int, default=100, help='concurrent sessions')
+            sub.add_argument('--requests', type=int, default=1000, help='requests per session')
+            sub.add_argument('--window', type=int, default=8, help='requests in flight per session')
+    options = parser.parse_args(args)
+
+    if options.command == 'serve':
+        try:
+            asyncio.run(serve(options))
+        except KeyboardInterrupt:
+            pass
+    elif options.command == 'load':
+        result = asyncio.run(load(options.host, options.port, options.unix,
+                                  options.sessions, options.requests, options.window))
+        print(json.dumps(result, indent=2))
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from play_with_compiler.craft.base_type import ASTNodeType, RELATIONAL_OPERATORS
+from array import array
+
+'''
+一个简单的栈式虚拟机。
+AST被编译成扁平的指令序列，每条指令占两个整数：操作码和操作数，存放在array('i')中；
+整数常量（可能任意大）放在单独的常量表里。
+'''
+
+# 操作码
+PUSH_CONST = 0      # 把常量表中第arg个常量压栈
+LOAD = 1            # 把槽位arg中的变量值压栈，编译时已经确定变量有值
+LOAD_CHECKED = 2    # 同上，但执行时检查变量是否有值
+ADD = 3
+SUB = 4
+MUL = 5
+DIV = 6             # 结果是浮点数，与SimpleScript.evaluate一致
+TRUNC = 7           # 对栈顶做int()，用在除法的结果作为操作数时
+STORE = 8           # 把int(栈顶)存入槽位arg，栈顶保留作为语句的值
+DECLARE = 9         # 声明变量但不赋值：槽位arg存入None，并压入None作为语句的值
+CHECK_DECLARED = 10 # 赋值之前检查槽位arg中的变量是否声明过
+END_STMT = 11       # 语句结束，弹出语句的值；arg是被赋值变量的槽位，表达式语句是-1
+COMPARE = 12        # 比较栈顶的两个值，结果是1或0；arg是运算符在COMPARE_OPERATORS中的下标
+
+OPCODE_NAMES = ['PUSH_CONST', 'LOAD', 'LOAD_CHECKED', 'ADD', 'SUB', 'MUL', 'DIV', 'TRUNC',
+                'STORE', 'DECLARE', 'CHECK_DECLARED', 'END_STMT', 'COMPARE']
+
+COMPARE_OPERATORS = list(RELATIONAL_OPERATORS)
+_COMPARE_FUNCTIONS = [RELATIONAL_OPERATORS[op] for op in COMPARE_OPERATORS]
+
+'''
+表示变量还没有声明。变量声明了但没有赋值时，值是None。
+'''
+_MISSING = object()
+
+'''
+编译好的字节码程序
+'''
+class VMProgram(object):
+    def __init__(self, code, consts, names):
+        self.code = code        # array('i')，操作码和操作数交替存放
+        self.consts = consts    # 常量表
+        self.names = names      # 槽位对应的变量名
+
+    '''
+    反汇编，便于调试
+    '''
+    def dump(self):
+        for pc in range(0, len(self.code), 2):
+            op = self.code[pc]
+            arg = self.code[pc + 1]
+            if op == PUSH_CONST:
+                print('%d\t%s\t%s' %(pc // 2, OPCODE_NAMES[op], self.consts[arg]))
+            elif op in (LOAD, LOAD_CHECKED, STORE, DECLARE, CHECK_DECLARED) or (op == END_STMT and arg >= 0):
+                print('%d\t%s\t%s' %(pc // 2, OPCODE_NAMES[op], self.names[arg]))
+            elif op == COMPARE:
+                print('%d\t%s\t%s' %(pc // 2, OPCODE_NAMES[op], COMPARE_OPERATORS[arg]))
+            else:
+                print('%d\t%s' %(pc // 2, OPCODE_NAMES[op]))
+
+    '''
+    在variables（变量名到值的字典）上执行，返回最后一个语句的值。
+    echo为True时，和SimpleScript.evaluate(node, '')一样打印每个语句的结果。
+    即使中途出错，已经执行的语句对变量的修改也会写回variables。
+    '''
+    def run(self, variables, echo=True):
+        names = self.names
+        slots = [variables.get(name, _MISSING) for name in names]
+        try:
+            return self.execute(slots, echo)
+        finally:
+            for name, value in zip(names, slots):
+                if value is not _MISSING:
+                    variables[name] = value
+
+    '''
+    解释执行的主循环。操作码按出现的频率排列判断顺序。
+    '''
+    def execute(self, slots, echo):
+        code = self.code
+        consts = self.consts
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        result = None
+        pc = 0
+        end = len(code)
+        while pc < end:
+            op = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+            if op == LOAD:
+                push(slots[arg])
+            elif op == PUSH_CONST:
+                push(consts[arg])
+            elif op == ADD:
+                right = pop()
+                stack[-1] = stack[-1] + right
+            elif op == MUL:
+                right = pop()
+                stack[-1] = stack[-1] * right
+            elif op == SUB:
+                right = pop()
+                stack[-1] = stack[-1] - right
+            elif op == DIV:
+                right = pop()
+                stack[-1] = stack[-1] / right
+            elif op == TRUNC:
+                stack[-1] = int(stack[-1])
+            elif op == LOAD_CHECKED:
+                value = slots[arg]
+                if value is None or value is _MISSING:
+                    raise Exception('variavle ' + self.names[arg] + ' has not been set any value')
+                push(value)
+            elif op == STORE:
+                slots[arg] = int(stack[-1])
+            elif op == END_STMT:
+                result = pop()
+                if echo:
+                    if arg >= 0:
+                        print('%s: %s' %(self.names[arg], result))
+                    else:
+                        print(result)
+            elif op == DECLARE:
+                slots[arg] = None
+                push(None)
+            elif op == CHECK_DECLARED:
+                if slots[arg] is _MISSING:
+                    raise Exception('unknown variable: ' + self.names[arg])
+            elif op == COMPARE:
+                right = pop()
+                stack[-1] = _COMPARE_FUNCTIONS[arg](stack[-1], right)
+        return result
+
+'''
+把SimpleParser生成的AST编译成字节码。
+和ScriptCompiler一样，编译时跟踪哪些变量肯定已经声明、肯定有值，省掉执行时的检查。
+表达式用显式的栈做后序遍历，再深的表达式也不会递归。
+'''
+class VMCompiler(object):
+    def __init__(self):
+        self.code = array('i')
+        self.consts = []
+        self.const_index = {}   # 常量 -> 常量表中的下标
+        self.slots = {}         # 变量名 -> 槽位
+        self.declared = set()   # 编译到当前位置时，肯定已经声明过的变量
+        self.assigned = set()   # 编译到当前位置时，肯定已经有整数值的变量
+
+    def compile(self, node):
+        children = node.get_children() if node.get_type() == ASTNodeType.Programm else [node]
+        for child in children:
+            node_type = child.get_type()
+            if node_type == ASTNodeType.IntDeclaration or node_type == ASTNodeType.AssignmentStmt:
+                self.compile_assignment(child)
+            else:
+                self.compile_expression(child)
+                self.emit(END_STMT, -1)
+        names = [None] * len(self.slots)
+        for name, slot in self.slots.items():
+            names[slot] = name
+        return VMProgram(self.code, self.consts, names)
+
+    def emit(self, op, arg=0):
+        self.code.append(op)
+        self.code.append(arg)
+
+    # 变量的槽位，第一次遇到时分配
+    def slot(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.slots)
+        return self.slots[name]
+
+    def const(self, value):
+        if value not in self.const_index:
+            self.const_index[value] = len(self.consts)
+            self.consts.append(value)
+        return self.const_index[value]
+
+    '''
+    变量声明和赋值语句
+    '''
+    def compile_assignment(self, node):
+        var_name = node.get_text()
+        slot = self.slot(var_name)
+        if node.get_type() == ASTNodeType.AssignmentStmt and var_name not in self.declared:
+            self.emit(CHECK_DECLARED, slot)
+        if node.get_type() == ASTNodeType.IntDeclaration:
+            self.declared.add(var_name)
+
+        if len(node.get_children()) > 0:
+            self.compile_expression(node.get_children()[0])
+            self.emit(STORE, slot)
+            self.assigned.add(var_name)
+        else:
+            self.emit(DECLARE, slot)
+            self.assigned.discard(var_name)
+        self.emit(END_STMT, slot)
+
+    '''
+    表达式，生成的指令执行完后，表达式的值在栈顶。
+    '''
+    def compile_expression(self, root):
+        stack = [[root, 0, False]] # [节点, 下一个要处理的子节点的下标, 结果是否需要取整]
+        while stack:
+            frame = stack[-1]
+            node, index, truncate = frame
+            node_type = node.get_type()
+            if (node_type == ASTNodeType.Additive or node_type == ASTNodeType.Multiplicative
+                    or node_type == ASTNodeType.Relational):
+                children = node.get_children()
+                if index < 2:
+                    frame[1] = index + 1
+                    # evaluate对操作数都做int()，但只有除法的结果不是整数
+                    stack.append([children[index], 0, True])
+                    continue
+                if node_type == ASTNodeType.Additive:
+                    self.emit(ADD if node.get_text() == '+' else SUB)
+                elif node_type == ASTNodeType.Relational:
+                    self.emit(COMPARE, COMPARE_OPERATORS.index(node.get_text()))
+                elif node.get_text() == '*':
+                    self.emit(MUL)
+                else:
+                    self.emit(DIV)
+                    if truncate:
+                        self.emit(TRUNC)
+            elif node_type == ASTNodeType.IntLiteral:
+                self.emit(PUSH_CONST, self.const(int(node.get_text())))
+            elif node_type == ASTNodeType.Identifier:
+                var_name = node.get_text()
+                self.emit(LOAD if var_name in self.assigned else LOAD_CHECKED, self.slot(var_name))
+            else:
+                raise Exception('unsupported node: ' + str(node_type))
+            stack.pop()
@@ -4,21 +4,48 @@ from play_with_compiler.craft.base_type import ASTNode
 from play_with_compiler.craft.base_type import Token, TokenReader, TokenType, ASTNodeType
 from play_with_compiler.craft.simple_lexer import SimpleLexer
 
+'''
+叶子节点共用的空子节点元组
+'''
+_NO_CHILDREN = ()
+
 '''
 一个简单的AST节点的实现。
 属性包括：类型、文本值、父节点、子节点。
+属性存放在__slots__中，没有__dict__；slot和resolution是NameResolver记录的解析结果，解析之前没有这两个属性。
+叶子节点（IntLiteral、Identifier）的子节点是共用的空元组，第一次add_child()时才创建列表。
+解析器构造节点时子节点都已经解析完毕，用add_children()一次给出，直接存成元组；
+只有根节点用add_child()逐个添加，解析完成后由freeze_tree()换成元组。冻结之后就不能再添加子节点了。
 '''
 class SimpleASTNode(ASTNode):
+    __slots__ = ('parent', 'children', 'node_type', 'text', 'slot', 'resolution')
+
     def __init__(self, node_type, text):
         self.parent = None
-        self.children = []
+        self.children = _NO_CHILDREN
         self.node_type = node_type
         self.text = text
 
     def add_child(self, child):
-        self.children.append(child)
+        if self.children is _NO_CHILDREN:
+            self.children = [child]
+        elif type(self.children) is tuple:
+            raise Exception('can not add a child to a frozen AST node')
+        else:
+            self.children.append(child)
         child.parent = self
 
+    # 一次给出全部子节点，直接存成元组
+    def add_children(self, *children):
+        if self.children:
+            raise Exception('can not add children to a node which already has children')
+        self.children = children
+        for child in children:
+            child.parent = self
+
+    def get_parent(self):
+        return self.parent
+
     def get_children(self):
         return self.children
 
@@ -28,6 +55,23 @@ class SimpleASTNode(ASTNode):
     def get_text(self):
         return self.text
 
+'''
+把AST冻结：每个节点的子节点列表换成元组。用显式的栈遍历，不递归。
+子节点已经是元组的节点（用add_children()构造的）认为整棵子树都已经冻结，不再往下遍历。
+'''
+def freeze_tree(root):
+    stack = [root]
+    pop = stack.pop
+    push = stack.extend
+    while stack:
+        node = pop()
+        children = node.children
+        if type(children) is list:
+            children = tuple(children)
+            node.children = children
+            push(children)
+    return root
+
 '''
 实现一个计算器，但计算的结合性是有问题的。因为它使用了下面的语法规则：
 additive -> multiplicative | multiplicative + additive
@@ -35,6 +79,8 @@ multiplicative -> primary | primary * multiplicative
 递归项在右边，会自然的对应右结合。我们真正需要的是左结合。
 '''
 class SimpleCalculator(object):
+    trace = None # 每求出一个节点的值就调用trace(node)，供Profiler统计，平时是None
+
     '''
     执行脚本，并打印输出AST和求值过程。
     '''
@@ -53,55 +99,83 @@ class SimpleCalculator(object):
         lexer = SimpleLexer()
         tokens = lexer.tokenize(code)
         rootNode = self.prog(tokens)
-        return rootNode
+        return freeze_tree(rootNode)
 
     '''
-    打印输出AST的树状结构
+    解析脚本文件，并返回根节点。文件被映射到内存中直接扫描，不需要先读成字符串。
+    '''
+    def parse_file(self, path):
+        lexer = SimpleLexer()
+        tokens = lexer.tokenize_file(path)
+        try:
+            rootNode = self.prog(tokens)
+        finally:
+            lexer.tokens.close()
+        return freeze_tree(rootNode)
+
+    '''
+    打印输出AST的树状结构。用显式的栈做先序遍历，不递归。
     '''
     def dump_AST(self, node, indent):
         if node == None:
             return
-        print('{}{} {}'.format(indent, node.node_type, node.text))
-        for item in node.children:
-            self.dump_AST(item, indent + "\t")
+        stack = [(node, 0)]
+        while stack:
+            node, depth = stack.pop()
+            print('{}{} {}'.format(indent + "\t" * depth, node.node_type, node.text))
+            for item in reversed(node.children):
+                stack.append((item, depth + 1))
 
     '''
     对某个AST节点求值，并打印求值过程。
+    用显式的栈做后序遍历，不递归，很长的表达式也不会超过递归深度限制。
     @param indent  打印输出时的缩进量
     '''
     def _evaluate(self, node, indent):
-        print("{} Calculating: {}".format(indent, node.node_type))
+        trace = self.trace
         result = 0
-        children = node.children
-        value1 = 0
-        value2 = 0
-        child1 = None
-        child2 = None
-
-        if (node.node_type == ASTNodeType.Programm):
-            for child in children:
-                result = self._evaluate(child, indent + "\t")
-        elif (node.node_type == ASTNodeType.Additive):
-            child1 = children[0]
-            value1 = self._evaluate(child1, indent + "\t")
-            child2 = children[1]
-            value2 = self._evaluate(child2, indent + "\t")
-            if (node.text == "+"):
-                result = int(value1) + int(value2)
-            else:
-                result = int(value1) - int(value2)
-        elif (node.node_type == ASTNodeType.Multiplicative):
-            child1 = children[0]
-            value1 = self._evaluate(child1, indent + "\t")
-            child2 = children[1]
-            value2 = self._evaluate(child2, indent + "\t")
-            if (node.text == "*"):
-                result = int(value1) * int(value2)
-            else:
-                result = int(value1) / int(value2)
-        elif (node.node_type == ASTNodeType.IntLiteral):
-            result = node.text
-        print("{} Result: {}".format(indent, result))
+        values = []                # 已经求出来、还没有被父节点取走的值
+        stack = [[node, 0, 0]]     # [节点, 相对于indent的深度, 下一个要求值的子节点的下标]
+        while stack:
+            frame = stack[-1]
+            node, depth, index = frame
+            children = node.children
+            if node.node_type not in (ASTNodeType.Programm, ASTNodeType.Additive, ASTNodeType.Multiplicative):
+                children = [] # 其他类型的节点不对子节点求值
+
+            if index == 0: # 第一次访问这个节点
+                print("{} Calculating: {}".format(indent + "\t" * depth, node.node_type))
+            if index < len(children): # 先求子节点的值
+                frame[2] = index + 1
+                stack.append([children[index], depth + 1, 0])
+                continue
+            stack.pop()
+
+            result = 0
+            if (node.node_type == ASTNodeType.Programm):
+                if children:
+                    result = values[-1]
+                    del values[-len(children):]
+            elif (node.node_type == ASTNodeType.Additive):
+                value2 = values.pop()
+                value1 = values.pop()
+                if (node.text == "+"):
+                    result = int(value1) + int(value2)
+                else:
+                    result = int(value1) - int(value2)
+            elif (node.node_type == ASTNodeType.Multiplicative):
+                value2 = values.pop()
+                value1 = values.pop()
+                if (node.text == "*"):
+                    result = int(value1) * int(value2)
+                else:
+                    result = int(value1) / int(value2)
+            elif (node.node_type == ASTNodeType.IntLiteral):
+                result = node.text
+            if trace != None:
+                trace(node)
+            print("{} Result: {}".format(indent + "\t" * depth, result))
+            values.append(result)
         return result
 
     '''
@@ -137,7 +211,7 @@ class SimpleCalculator(object):
                     if (child == None):
                         raise Exception('invalide variable initialization, expecting an expression')
                     else:
-                        node.add_child(child)
+                        node.add_children(child)
             else:
                 raise Exception('variable name expected')
 
@@ -162,8 +236,7 @@ class SimpleCalculator(object):
                     token = tokens.read() # 读出加号
                     child2 = self.multiplicative(tokens)  # 计算下级节点
                     node = SimpleASTNode(ASTNodeType.Additive, token.token_text)
-                    node.add_child(child1)  # 注意，新节点在顶层，保证正确的结合性
-                    node.add_child(child2)
+                    node.add_children(child1, child2)  # 注意，新节点在顶层，保证正确的结合性
                     child1 = node
                 else:
                     break
@@ -183,8 +256,7 @@ class SimpleCalculator(object):
                     child2 = self.primary(tokens)
                     if (child2 != None):
                         node = SimpleASTNode(ASTNodeType.Multiplicative, token.token_text)
-                        node.add_child(child1)
-                        node.add_child(child2)
+                        node.add_children(child1, child2)
                         child1 = node
                     else:
                         raise Exception('invalid additive expression, expecting the right part.')
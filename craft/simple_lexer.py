@@ -1,15 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from play_with_compiler.craft.base_type import Token, TokenReader, TokenType
+from array import array
 from enum import Enum
+import mmap
+import os
+import re
 
 '''
-Token的一个简单实现。只有类型和文本值两个属性。
+Token的一个简单实现。只有类型和文本值两个属性，存放在__slots__中，没有__dict__。
+tokenize_dfa在识别过程中会逐步修改当前Token，所以属性仍然是可写的。
 '''
 class SimpleToken(Token):
-    def __init__(self):
-        self.token_type = None
-        self.token_text = ''
+    __slots__ = ('token_type', 'token_text')
+
+    def __init__(self, token_type=None, token_text=''):
+        self.token_type = token_type
+        self.token_text = token_text
 
     def get_type(self):  # Token的类型
         return self.token_type
@@ -17,8 +24,86 @@ class SimpleToken(Token):
     def get_text(self):     # Token的文本值
         return self.token_text
 
+'''
+按类型值索引的TokenType，用于从紧凑存储中还原Token类型。
+'''
+_TOKEN_TYPE_BY_VALUE = [None] * len(TokenType)
+for _token_type in TokenType:
+    _TOKEN_TYPE_BY_VALUE[_token_type.value] = _token_type
+
+'''
+紧凑的Token存储。
+Token类型存放在array('B')中，Token文本用源代码中的起止位置表示，
+每个Token只占1+8+8个字节，而不是一个带__dict__的对象加一个字符串。
+按下标访问时才创建一个轻量的TokenView。
+'''
+class TokenBuffer(object):
+    def __init__(self, code):
+        self.code = code
+        self.types = array('B')
+        self.starts = array('q')
+        self.ends = array('q')
+
+    def append(self, token_type, start, end):
+        self.types.append(token_type.value)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        return TokenView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield TokenView(self, index)
+
+    # 第index个Token的文本
+    def get_text(self, index):
+        return self.code[self.starts[index]:self.ends[index]]
+
+'''
+建立在内存映射文件上的TokenBuffer。
+code是一个mmap对象，起止位置是字节偏移；Token的文本只有在被访问时才解码成字符串。
+用完之后需要调用close()释放映射。
+'''
+class MappedTokenBuffer(TokenBuffer):
+    def __init__(self, code, file):
+        TokenBuffer.__init__(self, code)
+        self.file = file
+
+    def get_text(self, index):
+        return self.code[self.starts[index]:self.ends[index]].decode('utf-8')
+
+    def close(self):
+        if isinstance(self.code, mmap.mmap):
+            self.code.close()
+        self.file.close()
+
+'''
+TokenBuffer中一个Token的视图。只保存所属的TokenBuffer和下标，没有__dict__。
+同时提供token_type和token_text属性，与SimpleToken的用法保持一致。
+'''
+class TokenView(Token):
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    def get_type(self):  # Token的类型
+        return _TOKEN_TYPE_BY_VALUE[self.buffer.types[self.index]]
+
+    def get_text(self):     # Token的文本值
+        return self.buffer.get_text(self.index)
+
+    token_type = property(get_type)
+    token_text = property(get_text)
+
 '''
 一个简单的Token流。是把一个Token列表进行了封装。
+tokens也可以是一个TokenBuffer。
 '''
 class SimpleTokenReader(TokenReader):
     def __init__(self, tokens): 
@@ -48,6 +133,66 @@ class SimpleTokenReader(TokenReader):
         if (position >=0 and position < len(self.tokens)):
             self.pos = position
 
+'''
+一个惰性的Token流。按需从Token迭代器中取Token，只在内存中保留一个窗口。
+位置是从流开头算起的绝对位置，与SimpleTokenReader一致；
+调用release()之后，当前位置之前的Token被丢弃，不能再回溯到那里。
+'''
+class StreamTokenReader(TokenReader):
+    def __init__(self, tokens):
+        self.source = iter(tokens)
+        self.window = [] # 窗口中的Token
+        self.base = 0    # window[0]的绝对位置
+        self.pos = 0
+
+    # 确保窗口中包含position处的Token，如果流已经结束，返回False
+    def fill(self, position):
+        while (self.base + len(self.window) <= position):
+            token = next(self.source, None)
+            if token == None:
+                return False
+            self.window.append(token)
+        return True
+
+    def read(self):
+        if self.fill(self.pos):
+            token = self.window[self.pos - self.base]
+            self.pos = self.pos + 1
+            return token
+        return None
+
+    def peek(self):
+        if self.fill(self.pos):
+            return self.window[self.pos - self.base]
+        return None
+
+    def unread(self):
+        if (self.pos > self.base):
+            self.pos = self.pos - 1
+
+    def get_position(self):
+        return self.pos
+
+    def set_position(self, position):
+        if (position < self.base):
+            raise Exception('can not backtrack to released token: ' + str(position))
+        if self.fill(position):
+            self.pos = position
+
+    def release(self):
+        del self.window[:self.pos - self.base]
+        self.base = self.pos
+
+'''
+把一个文件对象切成固定大小的文本块，逐块返回。
+'''
+def read_chunks(file, chunk_size=1024 * 1024):
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
 '''
 有限状态机的各种状态。
 '''
@@ -83,14 +228,158 @@ class DfaState(Enum):
 
     IntLiteral = 24
 
+    LT = 25
+    LE = 26
+    EQ = 27
+
+'''
+字符类别。表驱动的词法分析器先把每个字符映射成类别，再按 状态×类别 查表。
+i、n、t 单独成类，是为了识别关键字int。
+'''
+CC_OTHER = 0    # 其他字符，在Initial状态下会被跳过
+CC_ALPHA = 1    # 除i、n、t以外的字母
+CC_I = 2
+CC_N = 3
+CC_T = 4
+CC_DIGIT = 5
+CC_BLANK = 6    # 空格、制表符、换行
+CC_GT = 7
+CC_ASSIGNMENT = 8
+CC_PLUS = 9
+CC_MINUS = 10
+CC_STAR = 11
+CC_SLASH = 12
+CC_SEMICOLON = 13
+CC_LEFT_PAREN = 14
+CC_RIGHT_PAREN = 15
+CC_LT = 16
+CC_COUNT = 17
+
+'''
+构造字符类别表：256字节，可直接用于bytes.translate()。
+'''
+def _build_char_classes():
+    table = bytearray(256)
+    for ch in range(ord('a'), ord('z') + 1):
+        table[ch] = CC_ALPHA
+    for ch in range(ord('A'), ord('Z') + 1):
+        table[ch] = CC_ALPHA
+    for ch in range(ord('0'), ord('9') + 1):
+        table[ch] = CC_DIGIT
+    for ch, cc in (('i', CC_I), ('n', CC_N), ('t', CC_T),
+                   (' ', CC_BLANK), ('\t', CC_BLANK), ('\n', CC_BLANK),
+                   ('>', CC_GT), ('<', CC_LT), ('=', CC_ASSIGNMENT), ('+', CC_PLUS), ('-', CC_MINUS),
+                   ('*', CC_STAR), ('/', CC_SLASH), (';', CC_SEMICOLON),
+                   ('(', CC_LEFT_PAREN), (')', CC_RIGHT_PAREN)):
+        table[ord(ch)] = cc
+    return bytes(table)
+
+'''
+构造状态转移表，与init_token()/tokenize_dfa()中的if/elif逻辑一一对应。
+表的下标是 状态值*CC_COUNT+字符类别，内容是下一个状态的值；
+-1 表示当前Token到此结束，需要保存Token，并从Initial状态重新处理这个字符。
+'''
+def _build_transitions():
+    table = [-1] * (len(DfaState) * CC_COUNT)
+
+    def set_row(state, default, targets):
+        row = state.value * CC_COUNT
+        for cc in range(CC_COUNT):
+            table[row + cc] = default
+        for cc, target in targets:
+            table[row + cc] = target
+
+    id_chars = [(cc, DfaState.Id.value) for cc in (CC_ALPHA, CC_I, CC_N, CC_T, CC_DIGIT)]
+
+    # Initial状态：根据第一个字符确定后续状态，无法识别的字符留在Initial，即跳过
+    set_row(DfaState.Initial, DfaState.Initial.value, [
+        (CC_ALPHA, DfaState.Id.value), (CC_I, DfaState.Id_int1.value),
+        (CC_N, DfaState.Id.value), (CC_T, DfaState.Id.value),
+        (CC_DIGIT, DfaState.IntLiteral.value), (CC_GT, DfaState.GT.value),
+        (CC_ASSIGNMENT, DfaState.Assignment.value), (CC_PLUS, DfaState.Plus.value),
+        (CC_MINUS, DfaState.Minus.value), (CC_STAR, DfaState.Star.value),
+        (CC_SLASH, DfaState.Slash.value), (CC_SEMICOLON, DfaState.SemiColon.value),
+        (CC_LEFT_PAREN, DfaState.LeftParen.value), (CC_RIGHT_PAREN, DfaState.RightParen.value),
+        (CC_LT, DfaState.LT.value)])
+    set_row(DfaState.Id, -1, id_chars)
+    set_row(DfaState.IntLiteral, -1, [(CC_DIGIT, DfaState.IntLiteral.value)])
+    set_row(DfaState.GT, -1, [(CC_ASSIGNMENT, DfaState.GE.value)])
+    set_row(DfaState.LT, -1, [(CC_ASSIGNMENT, DfaState.LE.value)])
+    set_row(DfaState.Assignment, -1, [(CC_ASSIGNMENT, DfaState.EQ.value)])
+    set_row(DfaState.Id_int1, -1, id_chars + [(CC_N, DfaState.Id_int2.value)])
+    set_row(DfaState.Id_int2, -1, id_chars + [(CC_T, DfaState.Id_int3.value)])
+    # int后面只有遇到空白字符才成为关键字，其他任何字符都会并入标识符
+    set_row(DfaState.Id_int3, DfaState.Id.value, [(CC_BLANK, -1)])
+    # GE、LE、EQ、Plus等状态，遇到任何字符都结束，保持默认的-1
+    return table
+
+'''
+每个状态结束时对应的Token类型。下标是状态值。
+at_eof为True时，表示Token是因为输入结束而结束的。
+'''
+def _build_token_types(at_eof):
+    types = [None] * len(DfaState)
+    for state in (DfaState.Id, DfaState.Id_int1, DfaState.Id_int2):
+        types[state.value] = TokenType.Identifier
+    # int后面跟空白才是关键字；如果int出现在输入的末尾，仍然是标识符
+    types[DfaState.Id_int3.value] = TokenType.Identifier if at_eof else TokenType.Int
+    for name in ('GT', 'GE', 'LT', 'LE', 'EQ', 'Assignment', 'Plus', 'Minus', 'Star', 'Slash',
+                 'SemiColon', 'LeftParen', 'RightParen', 'IntLiteral'):
+        types[DfaState[name].value] = TokenType[name]
+    return types
+
+'''
+与上面的有限状态机等价的正则表达式，供mode='regex'使用。
+re.finditer()会自动跳过无法匹配的字符，这正是Initial状态跳过未知字符的行为。
+int后面紧跟空白字符才是关键字；跟着其他任何字符（包括分号、括号）都并入标识符。
+'''
+_TOKEN_PATTERN = re.compile(r'''
+    (?P<Int>int(?=[ \t\n]))
+  | (?P<Identifier>int[^ \t\n][A-Za-z0-9]*|[A-Za-z][A-Za-z0-9]*)
+  | (?P<IntLiteral>[0-9]+)
+  | (?P<GE>>=)
+  | (?P<GT>>)
+  | (?P<LE><=)
+  | (?P<LT><)
+  | (?P<EQ>==)
+  | (?P<Assignment>=)
+  | (?P<Plus>\+)
+  | (?P<Minus>-)
+  | (?P<Star>\*)
+  | (?P<Slash>/)
+  | (?P<SemiColon>;)
+  | (?P<LeftParen>\()
+  | (?P<RightParen>\))
+''', re.VERBOSE)
+
+'''
+_TOKEN_PATTERN的字节版本，直接扫描内存映射的文件。
+Token字符都是ASCII；只有int后面跟着的那个字符可能是多字节的UTF-8字符，要整个并入标识符。
+文本方式读文件时换行符\r\n和\r都被换成了\n，这里直接扫描原始的字节，所以\r也算空白字符，
+Windows格式的文件（比如int后面紧跟\r\n）和文本方式解析的结果相同。
+'''
+_BYTES_TOKEN_PATTERN = re.compile(_TOKEN_PATTERN.pattern.replace(
+    r'int(?=[ \t\n])', r'int(?=[ \t\n\r])').replace(
+    r'int[^ \t\n]', r'int(?:[^ \t\n\r\x80-\xff]|[\xc0-\xff][\x80-\xbf]*)').encode('ascii'), re.VERBOSE)
+
+_CHAR_CLASSES = _build_char_classes()
+_TRANSITIONS = _build_transitions()
+_TOKEN_TYPES = _build_token_types(False)
+_EOF_TOKEN_TYPES = _build_token_types(True)
+
 '''
 一个简单的手写的词法分析器。
 能够为后面的简单计算器、简单脚本语言产生Token。
+tokenize() 默认使用预先编译好的状态转移表（mode='table'），
+mode='regex' 时用一个编译好的正则表达式整体扫描，
+mode='compact' 时同样用正则表达式扫描，但把Token存放在紧凑的TokenBuffer中；
+mode='dfa' 时使用原来逐个状态if/elif判断的实现，便于对比。
 '''
 class SimpleLexer(object):
-    def __init__(self):
+    def __init__(self, mode='table'):
         self.token = SimpleToken() # 当前正在解析的Token
         self.tokens = [] # 保存解析出来的Token
+        self.mode = mode
 
     # 是否是字母
     def is_alpha(self, ch):
@@ -137,6 +426,10 @@ class SimpleLexer(object):
             new_state = DfaState.GT
             self.token.token_type = TokenType.GT
             self.token.token_text += ch
+        elif (ch == '<'):
+            new_state = DfaState.LT
+            self.token.token_type = TokenType.LT
+            self.token.token_text += ch
         elif (ch == '+'):
             new_state = DfaState.Plus
             self.token.token_type = TokenType.Plus
@@ -175,9 +468,128 @@ class SimpleLexer(object):
 
     '''
     解析字符串，形成Token。
-    这是一个有限状态自动机，在不同的状态中迁移。
     '''
     def tokenize(self, code):
+        if self.mode == 'dfa':
+            return self.tokenize_dfa(code)
+        if self.mode == 'regex':
+            return self.tokenize_regex(code)
+        if self.mode == 'compact':
+            return self.tokenize_compact(code)
+        return self.tokenize_table(code)
+
+    '''
+    用一个编译好的正则表达式扫描整个字符串。
+    逐字符的循环交给re模块在C里完成，每个Token一次性由匹配到的切片创建。
+    '''
+    def tokenize_regex(self, code):
+        token_types = TokenType.__members__
+        tokens = [SimpleToken(token_types[m.lastgroup], m.group())
+                  for m in _TOKEN_PATTERN.finditer(code)]
+        self.tokens = tokens
+        self.token = SimpleToken()
+        return SimpleTokenReader(tokens)
+
+    '''
+    用正则表达式扫描，结果存放在TokenBuffer中，不为每个Token创建对象。
+    '''
+    def tokenize_compact(self, code):
+        token_types = TokenType.__members__
+        tokens = TokenBuffer(code)
+        append = tokens.append
+        for m in _TOKEN_PATTERN.finditer(code):
+            append(token_types[m.lastgroup], m.start(), m.end())
+        self.tokens = tokens
+        self.token = SimpleToken()
+        return SimpleTokenReader(tokens)
+
+    '''
+    把文件映射到内存中，直接扫描其中的字节，不把整个文件读成字符串。
+    多个进程解析同一个文件时，共享操作系统的页缓存。
+    返回的Token流建立在MappedTokenBuffer上，用完后调用self.tokens.close()释放文件。
+    '''
+    def tokenize_file(self, path):
+        token_types = TokenType.__members__
+        file = open(path, 'rb')
+        try:
+            # 空文件无法映射
+            code = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(file.fileno()).st_size > 0 else b''
+        except Exception:
+            file.close()
+            raise
+        tokens = MappedTokenBuffer(code, file)
+        append = tokens.append
+        for m in _BYTES_TOKEN_PATTERN.finditer(code):
+            append(token_types[m.lastgroup], m.start(), m.end())
+        self.tokens = tokens
+        self.token = SimpleToken()
+        return SimpleTokenReader(tokens)
+
+    '''
+    逐块解析文本，惰性地产生Token。
+    chunks可以是文件对象（按chunk_size分块读取），也可以是任何返回字符串的迭代器。
+    一个Token可能跨越两个文本块，所以每块最后一个匹配到的Token（以及它后面被跳过的字符）
+    要留到和下一块拼接之后再解析；最后一块解析完，剩下的部分才是完整的。
+    '''
+    def iter_tokens(self, chunks, chunk_size=1024 * 1024):
+        if hasattr(chunks, 'read'):
+            chunks = read_chunks(chunks, chunk_size)
+        token_types = TokenType.__members__
+        pending = ''
+        for chunk in chunks:
+            pending += chunk
+            last = None
+            for m in _TOKEN_PATTERN.finditer(pending):
+                if last != None:
+                    yield SimpleToken(token_types[last.lastgroup], last.group())
+                last = m
+            pending = pending[last.start():] if last != None else ''
+        for m in _TOKEN_PATTERN.finditer(pending):
+            yield SimpleToken(token_types[m.lastgroup], m.group())
+
+    '''
+    返回一个惰性的Token流，Token在Parser需要的时候才被解析出来。
+    '''
+    def tokenize_stream(self, chunks, chunk_size=1024 * 1024):
+        self.tokens = []
+        self.token = SimpleToken()
+        return StreamTokenReader(self.iter_tokens(chunks, chunk_size))
+
+    '''
+    表驱动的有限状态自动机。
+    先用bytes.translate()把整个字符串一次性映射成字符类别，再逐个类别查状态转移表。
+    非ASCII字符被编码成'?'，和原实现一样归入无法识别的字符。
+    Token的文本直接从源代码切片得到，不再逐个字符拼接。
+    '''
+    def tokenize_table(self, code):
+        tokens = []
+        classes = code.encode('ascii', 'replace').translate(_CHAR_CLASSES)
+        transitions = _TRANSITIONS
+        token_types = _TOKEN_TYPES
+        state = DfaState.Initial.value
+        start = 0
+
+        for i, cc in enumerate(classes):
+            next_state = transitions[state * CC_COUNT + cc]
+            if next_state < 0: # 当前Token结束，保存Token，然后从Initial状态重新处理这个字符
+                tokens.append(SimpleToken(token_types[state], code[start:i]))
+                state = DfaState.Initial.value
+                next_state = transitions[cc]
+            if state == DfaState.Initial.value:
+                start = i
+            state = next_state
+        # 把最后一个token送进去
+        if state != DfaState.Initial.value:
+            tokens.append(SimpleToken(_EOF_TOKEN_TYPES[state], code[start:]))
+
+        self.tokens = tokens
+        self.token = SimpleToken()
+        return SimpleTokenReader(tokens)
+
+    '''
+    原来的实现：一个有限状态自动机，在不同的状态中迁移。
+    '''
+    def tokenize_dfa(self, code):
         self.tokens = []
         self.token = SimpleToken()
         ich = 0
@@ -200,7 +612,21 @@ class SimpleLexer(object):
                     self.token.token_text += ch
                 else:
                     state = self.init_token(ch)   # 退出GT状态，并保存Token
-            elif (state in [DfaState.GE, DfaState.Assignment, DfaState.Plus, DfaState.Minus, DfaState.Star,  
+            elif (state == DfaState.LT):
+                if (ch == '='):
+                    self.token.token_type = TokenType.LE  # 转换成LE
+                    state = DfaState.LE
+                    self.token.token_text += ch
+                else:
+                    state = self.init_token(ch)
+            elif (state == DfaState.Assignment):
+                if (ch == '='):
+                    self.token.token_type = TokenType.EQ  # 转换成EQ
+                    state = DfaState.EQ
+                    self.token.token_text += ch
+                else:
+                    state = self.init_token(ch)
+            elif (state in [DfaState.GE, DfaState.LE, DfaState.EQ, DfaState.Plus, DfaState.Minus, DfaState.Star,  
                     DfaState.Slash, DfaState.SemiColon, DfaState.LeftParen, DfaState.RightParen]):
                 state = self.init_token(ch)       # 退出当前状态，并保存Token
             elif (state == DfaState.IntLiteral):
@@ -3,7 +3,7 @@
 
 from play_with_compiler.craft.simple_lexer import SimpleLexer
 from play_with_compiler.craft.base_type import Token, TokenReader, ASTNodeType, TokenType
-from play_with_compiler.craft.simple_calculator import SimpleASTNode
+from play_with_compiler.craft.simple_calculator import SimpleASTNode, freeze_tree
 
 '''
  * 一个简单的语法解析器。
@@ -19,20 +19,60 @@ from play_with_compiler.craft.simple_calculator import SimpleASTNode
 '''
 class SimpleParser(object):
     '''
-    解析脚本
+    predictive为True时，用一到两个Token的预读直接确定语句的类型，每个语句只解析一次；
+    为False时使用原来的做法，依次尝试各种语句，失败了就回溯。
+    '''
+    def __init__(self, predictive=True):
+        self.predictive = predictive
+
+    '''
+    解析脚本。返回的AST已经冻结，子节点是元组。
     '''
     def parse(self, script):
         lexer = SimpleLexer()
         tokens = lexer.tokenize(script)
         root_node = self.prog(tokens)
-        return root_node
+        return freeze_tree(root_node)
+
+    '''
+    从文件中解析脚本。Token是按需从文件中逐块解析出来的，
+    内存中只保留当前语句的Token，用于回溯。
+    mapped为True时，把文件映射到内存中直接扫描，Token存放在紧凑的TokenBuffer中。
+    '''
+    def parse_file(self, path, chunk_size=1024 * 1024, mapped=False):
+        lexer = SimpleLexer()
+        if mapped:
+            tokens = lexer.tokenize_file(path)
+            try:
+                root_node = self.prog(tokens)
+            finally:
+                lexer.tokens.close()
+            return freeze_tree(root_node)
+        with open(path) as file:
+            tokens = lexer.tokenize_stream(file, chunk_size)
+            root_node = self.prog(tokens)
+        return freeze_tree(root_node)
 
     '''
     AST的根节点，解析的入口
     '''
     def prog(self, tokens):
         node = SimpleASTNode(ASTNodeType.Programm, 'pwc')
+        for child in self.iter_statements(tokens):
+            node.add_child(child)
+        return node
+
+    '''
+    逐个解析顶层语句，每解析完一个就返回它，不构造Programm节点。
+    调用者处理完一个语句就可以丢弃它，配合StreamTokenReader，整个过程只占用一个语句的内存。
+    '''
+    def iter_statements(self, tokens):
         while tokens.peek():
+            tokens.release() # 之前的语句已经解析完毕，不会再回溯
+            if self.predictive:
+                yield self.statement(tokens)
+                continue
+
             child = self.int_declare(tokens)
             
             if not child:
@@ -41,15 +81,33 @@ class SimpleParser(object):
             if not child:
                 child = self.assignment_statement(tokens)
 
-            if not child:
-                node.add_child(child)
-
             if not child:
                 raise Exception('unknown statement')
 
-            node.add_child(child)
-            
-        return node
+            yield child
+
+    '''
+    预测分析的语句入口，不需要回溯：
+    int开头的是变量声明；标识符后面紧跟等号的是赋值语句；其他的都是表达式语句。
+    '''
+    def statement(self, tokens):
+        token = tokens.peek()
+        if (token.get_type() == TokenType.Int):
+            return self.int_declare(tokens)
+        if (token.get_type() == TokenType.Identifier):
+            tokens.read()
+            token = tokens.peek() # 预读第二个Token，看是不是等号
+            tokens.unread()
+            if (token and token.get_type() == TokenType.Assignment):
+                return self.assignment_statement(tokens)
+
+        node = self.additive(tokens)
+        if node:
+            token = tokens.peek()
+            if (token and token.get_type() == TokenType.SemiColon):
+                tokens.read()
+                return node
+        raise Exception('unknown statement') # 与回溯方式下所有语句都尝试失败时的报错一致
 
     '''
     表达式语句，即表达式后面跟个分号
@@ -82,7 +140,7 @@ class SimpleParser(object):
                 if (child == None): # 出错，等号右边不是一个合法的表达式
                     raise Exception('invalide assignment statement, expecting an expression')
                 else:
-                    node.add_child(child) # 添加子节点
+                    node.add_children(child) # 添加子节点
                     token = tokens.peek() # 预读，看后面是不是分号
                     if (token != None and token.get_type() == TokenType.SemiColon):
                         tokens.read()  # 消耗掉该分号
@@ -113,7 +171,7 @@ class SimpleParser(object):
                     if (not child):
                         raise Exception('invlide variable initialization, expecting an expression')
                     else:
-                        node.add_child(child)
+                        node.add_children(child)
             else:
                 raise Exception('variable name expected')
 
@@ -139,8 +197,7 @@ class SimpleParser(object):
                     child2 = self.multiplicative(tokens) # 计算下级节点
                     if child2:
                         node = SimpleASTNode(ASTNodeType.Additive, token.get_text())
-                        node.add_child(child1)
-                        node.add_child(child2)
+                        node.add_children(child1, child2)
                         child1 = node
                     else:
                         raise Exception('invlide additive expression, expecting the right part.')
@@ -161,8 +218,7 @@ class SimpleParser(object):
                 child2 = self.primary(tokens)
                 if (child2 != None):
                     node = SimpleASTNode(ASTNodeType.Multiplicative, token.get_text())
-                    node.add_child(child1)
-                    node.add_child(child2)
+                    node.add_children(child1, child2)
                     child1 = node
                 else:
                     raise Exception('invalid multiplicative expression, expecting the right part.')
@@ -204,9 +260,12 @@ class SimpleParser(object):
     def dump_AST(self, node, indent):
         if not node:
             return
-        print("%s%s %s" %(indent, node.node_type, node.text))
-        for child in node.get_children():
-            self.dump_AST(child, indent + "\t")
+        stack = [(node, 0)] # 用显式的栈做先序遍历，不递归
+        while stack:
+            node, depth = stack.pop()
+            print("%s%s %s" %(indent + "\t" * depth, node.node_type, node.text))
+            for child in reversed(node.get_children()):
+                stack.append((child, depth + 1))
 
     
 
@@ -2,7 +2,13 @@
 # -*- coding: utf-8 -*-
 
 from play_with_compiler.craft.simple_parser import SimpleParser
-from play_with_compiler.craft.base_type import ASTNodeType
+from play_with_compiler.craft.simple_lexer import SimpleLexer
+from play_with_compiler.craft.base_type import ASTNodeType, RELATIONAL_OPERATORS
+from play_with_compiler.craft.script_compiler import ScriptCompiler
+from play_with_compiler.craft.script_vm import VMCompiler
+from play_with_compiler.craft.parse_cache import ParseCache
+from play_with_compiler.craft.ast_optimizer import ASTOptimizer
+from play_with_compiler.craft.name_resolver import NameResolver, SymbolTable, UNDECLARED
 import sys
 
 '''
@@ -20,73 +26,147 @@ import sys
  * > exit();  //退出REPL界面。
  *
  * 你还可以使用一个参数 -v，让每次执行脚本的时候，都输出AST和整个计算过程。
+ * 参数 -O 会在求值之前对AST做常量折叠和代数化简。
+ *
+ * 执行脚本文件：python simple_script.py script.play
+ * 文件是流式执行的，每解析出一个语句就立即执行。
  '''
 class SimpleScript(object):
+    trace = None # 每求出一个节点的值就调用trace(node)，供Profiler统计，平时是None
+
     def __init__(self, verbose):
-       self._variables = {}
+       self._variables = SymbolTable() # 变量表，可以像字典一样按名字访问
+       self._resolver = NameResolver()
        self._verbose = verbose
 
     '''
-    遍历AST，计算值
+    遍历AST，计算值。node是Programm节点或者一个顶层语句。
+    用显式的栈做后序遍历，不递归，所以很长的表达式（比如上百万项的1+1+...+1）也不会超过Python的递归深度限制。
+    缩进用深度表示，只有在verbose模式下需要打印时才拼出缩进字符串，避免深层的树每个节点都复制一次缩进。
+    求值之前先做名字解析（同一棵AST只做一次），使用未声明的变量在解析时就报错，不会执行任何语句。
+    每个语句开始执行时把它的槽位对应到变量表的槽位，之后按node.slot直接存取变量表的值列表。
     '''
     def evaluate(self, node, indent):
+        self._resolver.check(self._resolver.resolve(node), self._variables)
+        slots = self._variables.values # 变量表中按槽位存放的变量值
+        binding = None                 # 当前语句的槽位 -> 变量表的槽位
+        trace = self.trace
+        result = None
+        values = []                # 已经求出来、还没有被父节点取走的值
+        stack = [[node, 0, 0]]     # [节点, 相对于indent的深度, 下一个要求值的子节点的下标]
+        while stack:
+            frame = stack[-1]
+            node, depth, index = frame
+            node_type = node.get_type()
+            children = node.get_children()
+
+            if index == 0: # 第一次访问这个节点
+                if self._verbose:
+                    print('%s Calcalationg: %s:' %(indent + '\t' * depth, node_type))
+                if depth == 0 and node_type != ASTNodeType.Programm:
+                    binding = self._variables.bind(node.resolution.names)
+                if node_type == ASTNodeType.AssignmentStmt and slots[binding[node.slot]] is UNDECLARED:
+                    raise Exception('unknown variable: ' + node.get_text())
+
+            if index < len(children): # 先求子节点的值
+                frame[2] = index + 1
+                stack.append([children[index], depth if node_type == ASTNodeType.Programm else depth + 1, 0])
+                continue
+            stack.pop()
+
+            result = None
+            if node_type == ASTNodeType.Programm:
+                if children:
+                    result = values[-1]
+                    del values[-len(children):]
+            elif node_type == ASTNodeType.Additive:
+                value2 = values.pop()
+                value1 = values.pop()
+                if node.get_text() == '+':
+                    result = int(value1) + int(value2)
+                else:
+                    result = int(value1) - int(value2)
+            elif node_type == ASTNodeType.Multiplicative:
+                value2 = values.pop()
+                value1 = values.pop()
+                if node.get_text() == '*':
+                    result = int(value1) * int(value2)
+                else:
+                    result = int(value1) / int(value2)
+            elif node_type == ASTNodeType.Relational:
+                value2 = values.pop()
+                value1 = values.pop()
+                result = RELATIONAL_OPERATORS[node.get_text()](int(value1), int(value2))
+            elif node_type == ASTNodeType.IntLiteral:
+                result = int(node.get_text())
+            elif node_type == ASTNodeType.Identifier:
+                value = slots[binding[node.slot]]
+                if value != None and value is not UNDECLARED:
+                    result = int(value)
+                else:
+                    raise Exception('variavle ' + node.get_text() + ' has not been set any value')
+            elif node_type == ASTNodeType.AssignmentStmt or node_type == ASTNodeType.IntDeclaration:
+                # 赋值语句在第一次访问时已经检查过变量，之后和变量声明执行同样的代码
+                var_value = None
+                if children:
+                    result = values.pop()
+                    var_value = int(result)
+                slots[binding[node.slot]] = var_value
+
+            if trace != None:
+                trace(node)
+            if self._verbose:
+                print('%sResult: %s' %(indent + '\t' * depth, result))
+            elif indent == '' and depth == 0:
+                if node_type == ASTNodeType.IntDeclaration or node_type == ASTNodeType.AssignmentStmt:
+                    print('%s: %s' %(node.get_text(), result))
+                elif node_type != ASTNodeType.Programm:
+                    print(result)
+            values.append(result)
+        return result
+
+    '''
+    编译AST。编译一次，可以反复用run()执行。
+    backend为'closure'时编译成闭包，为'vm'时编译成字节码，在栈式虚拟机上执行。
+    '''
+    def compile(self, node, backend='closure'):
+        free_names = self._resolver.resolve(node).free_names
+        if backend == 'vm':
+            program = VMCompiler().compile(node)
+        else:
+            program = ScriptCompiler().compile(node)
+        program.free_names = free_names
+        return program
+
+    '''
+    执行编译好的脚本，结果和非verbose模式下的evaluate(node, '')相同，
+    使用未声明的变量同样在执行任何语句之前就报错
+    '''
+    def run(self, program, echo=True):
+        self._resolver.check(program, self._variables)
+        return program.run(self._variables, echo)
+
+    '''
+    流式执行：statements中每个顶层语句一拿到就执行，执行完就不再引用它的AST。
+    输出和对整个Programm调用evaluate(node, '')相同，区别是每个语句执行之前才检查它用到的变量，
+    使用未声明的变量时，前面的语句已经执行过了。返回最后一个语句的值。
+    '''
+    def evaluate_stream(self, statements):
         result = None
-        if self._verbose:
-            print('%s Calcalationg: %s:' %(indent, node.get_type()))
-        
-        if node.get_type() == ASTNodeType.Programm:
-            for child in node.get_children():
-                result = self.evaluate(child, indent)
-        elif node.get_type() == ASTNodeType.Additive:
-            child1 = node.get_children()[0]
-            value1 = self.evaluate(child1, indent + "\t")
-            child2 = node.get_children()[1]
-            value2 = self.evaluate(child2, indent + "\t")
-            if node.get_text() == '+':
-                result = int(value1) + int(value2)
-            else:
-                result = int(value1) - int(value2)
-        elif node.get_type() == ASTNodeType.Multiplicative:
-            child1 = node.get_children()[0]
-            value1 = self.evaluate(child1, indent + "\t")
-            child2 = node.get_children()[1]
-            value2 = self.evaluate(child2, indent + "\t")
-            if node.get_text() == '*':
-                result = int(value1) * int(value2)
-            else:
-                result = int(value1) / int(value2)
-        elif node.get_type() == ASTNodeType.IntLiteral:
-            result = int(node.get_text())
-        elif node.get_type() == ASTNodeType.Identifier:
-            var_name = node.get_text()
-            value = self._variables.get(var_name)
-            if value != None:
-                result = int(value)
-            else:
-                raise Exception('variavle ' + var_name + ' has not been set any value')
-        elif node.get_type() == ASTNodeType.AssignmentStmt:
-            var_name = node.get_text()
-            if var_name not in self._variables.keys():
-                raise Exception('unknown variable: ' + var_name)
-            # 接着执行下面的代码
-        elif node.get_type() == ASTNodeType.IntDeclaration:
-            var_name = node.get_text()
-            var_value = None
-            if len(node.get_children()) > 0:
-                child = node.get_children()[0]
-                result = self.evaluate(child, indent + '\t')
-                var_value = int(result)
-            self._variables[var_name] = var_value
-        
-        if self._verbose:
-            print('%sResult: %s' %(indent, result))
-        elif indent == '':
-            if node.get_type() == ASTNodeType.IntDeclaration or node.get_type() == ASTNodeType.AssignmentStmt:
-                print('%s: %s' %(node.get_text(), result))
-            elif node.get_type() != ASTNodeType.Programm:
-                print(result)
+        for statement in statements:
+            result = self.evaluate(statement, '')
         return result
 
+    '''
+    流式执行脚本文件。文件逐块读入、按需做词法分析，只保留当前语句的Token和AST，
+    所以内存占用和脚本的大小无关，第一个语句的结果也不必等整个文件解析完就能输出。
+    '''
+    def evaluate_file(self, path, chunk_size=1024 * 1024):
+        parser = SimpleParser()
+        with open(path) as file:
+            tokens = SimpleLexer().tokenize_stream(file, chunk_size)
+            return self.evaluate_stream(parser.iter_statements(tokens))
+
 '''
 实现一个简单的 REPL
 '''
@@ -95,21 +175,35 @@ def play(args):
     if (len(args) > 0 and args[0] == '-v'):
         verbose = True
         print('verbose mode')
+    optimize = '-O' in args
+    paths = [arg for arg in args if not arg.startswith('-')]
+    if paths:
+        script = SimpleScript(verbose)
+        try:
+            for path in paths:
+                script.evaluate_file(path)
+        except Exception as e:
+            print(e)
+            sys.exit(1)
+        return
     print('Simple script language!')
 
     parser = SimpleParser()
+    cache = ParseCache(parser) # 同样的语句不再重复解析
     script = SimpleScript(verbose)
     script_text = ""
 
     while True:
         try:
-            line = raw_input(">")
+            line = input(">")
             if line == 'exit();':
                 print("good bye!")
                 break
             script_text += line + "\n"
             if line.endswith(";"):
-                tree = parser.parse(script_text)
+                tree = cache.parse(script_text)
+                if optimize:
+                    tree = ASTOptimizer().optimize(tree)
                 if verbose:
                     parser.dump_AST(tree, "")
                 script.evaluate(tree, "")
@@ -118,4 +212,5 @@ def play(args):
             print('119: %s' %e)
             script_text = ''
 
-play(sys.argv[1:])
\ No newline at end of file
+if __name__ == '__main__':
+    play(sys.argv[1:])
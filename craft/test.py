@@ -3,6 +3,22 @@
 from simple_lexer import SimpleLexer
 from simple_calculator import SimpleCalculator
 from simple_parser import SimpleParser
+from precedence_parser import PrecedenceParser
+from ll1_parser import LL1Parser, CALCULATOR_GRAMMAR
+from simple_script import SimpleScript
+from ast_optimizer import ASTOptimizer
+from flat_ast import FlatAST
+from incremental_parser import IncrementalParser
+from reactive_script import ReactiveScript
+from script_cache import ScriptCache
+from script_server import ScriptServer, Session
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
 
 def test_simple_lexer():
     lexer = SimpleLexer()
@@ -36,6 +52,37 @@ def test_simple_lexer():
     tokenReader = lexer.tokenize(script)
     lexer.dump(tokenReader)
 
+def test_table_lexer():
+    # 各种方式的词法分析器应该和原来的有限状态机产生完全相同的Token
+    for script in ["int age = 45;", "inta age = 45;", "in age = 45;", "age >= 45;", "int(a)", "age > 45;",
+                   "a <= 1 == b < 2;", "int\tb=1;int\n"]:
+        expected = [(t.get_type(), t.get_text()) for t in SimpleLexer('dfa').tokenize(script).tokens]
+        for mode in ['table', 'regex']:
+            actual = [(t.get_type(), t.get_text()) for t in SimpleLexer(mode).tokenize(script).tokens]
+            assert actual == expected, (mode, script, actual)
+
+def test_crlf_file():
+    # 内存映射的tokenize_file和按文本方式读入的文件，在Windows换行符的文件上产生相同的Token
+    script = b"int\r\na = 1;\r\nint\rb = a;\r\ninta = 2;\r\na + b;\r\n"
+    fd, path = tempfile.mkstemp(suffix='.play')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(script)
+        with open(path) as file:
+            expected = [(t.get_type(), t.get_text()) for t in SimpleLexer().tokenize(file.read()).tokens]
+        lexer = SimpleLexer()
+        reader = lexer.tokenize_file(path)
+        actual = []
+        token = reader.read()
+        while token != None:
+            actual.append((token.get_type(), token.get_text()))
+            token = reader.read()
+        lexer.tokens.close()
+        assert actual == expected, actual
+        assert actual[0][1] == 'int' and actual[5][1] == 'int'
+    finally:
+        os.remove(path)
+
 def test_simple_calculator():
     calculator = SimpleCalculator()
 
@@ -100,8 +147,282 @@ def test_simple_parser():
     except Exception as e:
         print(e)
 
+# 把AST展开成(深度, 类型, 文本)的列表，用来比较两棵AST是否相同
+def flatten_AST(node):
+    result = []
+    stack = [(node, 0)]
+    while stack:
+        node, depth = stack.pop()
+        result.append((depth, node.get_type(), node.get_text()))
+        stack.extend((child, depth + 1) for child in reversed(node.get_children()))
+    return result
+
+def test_ll1_parser():
+    # 不含关系运算时，LL(1)分析器和SimpleParser生成相同的AST
+    for script in ["int age = 45;", "int a; a = 2+3*5; a;", "(1+2)*3-4/2;", "a*(b-1);"]:
+        assert flatten_AST(LL1Parser().parse(script)) == flatten_AST(SimpleParser().parse(script)), script
+
+    # 含关系运算时，和PrecedenceParser生成相同的AST
+    for script in ["int a = 1; a < 2;", "a+1 >= 3*a == 1;", "int b = a <= 2;", "b = (a > 1) < 2;", "1 == 2 == 3;"]:
+        assert flatten_AST(LL1Parser().parse(script)) == flatten_AST(PrecedenceParser().parse(script)), script
+
+    # 语法错误
+    for script in ["1 < ;", "a = 1 <;", "< 2;"]:
+        try:
+            LL1Parser().parse(script)
+            assert False, script
+        except Exception as e:
+            assert str(e).startswith('unexpected'), e
+
+    check_backend('ll1', lambda script, tree: evaluate_tree(LL1Parser().parse(script)))
+
+'''
+各个后端的测试脚本。最后几个会出错：使用未声明的变量、变量没有赋值、除以零。
+'''
+BACKEND_SCRIPTS = [
+    "int a = 1; int b = a + 2 * 3; b = (b - a) / 4; a * b - b / 4;",
+    "int x; x = 7; int y = x / 2; y + x / 2 * 2;",
+    "1 + 2; 3 * (4 - 5); 10 / 4; 2 - 3 - 4; 2 * 3 / 4 * 5;",
+    "int a = 0; a = a + 1; a = a * 10; a = a - a / 3; a;",
+    "int a = 1; a + b;",
+    "int a; a + 1;",
+    "int a = 1; a = a / 0;",
+]
+
+'''
+含关系运算的脚本，SimpleParser不支持，用PrecedenceParser解析
+'''
+RELATIONAL_SCRIPTS = [
+    "int a = 2; a < 3; a >= 2 == 1; int c = a * a > 3; c + (a <= 1) + (a == 2);",
+    "int a = 5; a = a > 4; a + 1 < 2 * 3;",
+]
+
+# 测试脚本和解析它用的解析器
+def backend_cases():
+    return [(script, SimpleParser()) for script in BACKEND_SCRIPTS] + \
+           [(script, PrecedenceParser()) for script in RELATIONAL_SCRIPTS]
+
+# 执行run，返回打印的内容、变量和报错
+def capture(run, variables):
+    output = io.StringIO()
+    error = None
+    with contextlib.redirect_stdout(output):
+        try:
+            run()
+        except Exception as e:
+            error = str(e)
+    return output.getvalue(), dict(variables.items()), error
+
+def evaluate_tree(tree):
+    interpreter = SimpleScript(False)
+    return capture(lambda: interpreter.evaluate(tree, ''), interpreter._variables)
+
+'''
+在所有的测试脚本上比较一个后端和SimpleScript.evaluate：打印的内容、变量、报错都相同。
+run(script, tree)用这个后端执行脚本，返回和capture()同样的结果。
+'''
+def check_backend(name, run):
+    for script, parser in backend_cases():
+        tree = parser.parse(script)
+        expected = evaluate_tree(tree)
+        actual = run(script, tree)
+        assert actual == expected, (name, script, actual, expected)
+
+def run_compiled(tree, backend):
+    interpreter = SimpleScript(False)
+    program = interpreter.compile(tree, backend)
+    return capture(lambda: interpreter.run(program), interpreter._variables)
+
+def test_shared_tree():
+    # 槽位记在AST上，同一棵AST在变量布局不同的两个变量表上执行，结果互不影响
+    tree = SimpleParser().parse("b = a * 2; int c = b + a;")
+    first = SimpleScript(False)
+    second = SimpleScript(False)
+    capture(lambda: first.evaluate(SimpleParser().parse("int a = 1; int b;"), ''), first._variables)
+    capture(lambda: second.evaluate(SimpleParser().parse("int x = 0; int b; int a = 5;"), ''), second._variables)
+    for script in [first, second, first]:
+        capture(lambda: script.evaluate(tree, ''), script._variables)
+    assert dict(first._variables.items()) == {'a': 1, 'b': 2, 'c': 3}
+    assert dict(second._variables.items()) == {'x': 0, 'b': 10, 'a': 5, 'c': 15}
+    third = SimpleScript(False)
+    assert capture(lambda: third.evaluate(tree, ''), third._variables)[1:] == ({}, 'unknown variable: b')
+
+def test_script_compiler():
+    check_backend('closure', lambda script, tree: run_compiled(tree, 'closure'))
+
+    # 很长的运算链编译成一个循环，不会超过递归深度限制
+    tree = SimpleParser().parse("int a = 7; a = " + " + ".join(["a / 2 * 3 - 1"] * 5000) + "; a / 2 - a / 3 - 1;")
+    assert run_compiled(tree, 'closure') == evaluate_tree(tree)
+
+def test_ast_optimizer():
+    # 优化可能删掉会出错的表达式（比如a / 0 * 0），只比较没有出错的脚本
+    for script, parser in backend_cases():
+        tree = parser.parse(script)
+        expected = evaluate_tree(tree)
+        if expected[2] == None:
+            assert evaluate_tree(ASTOptimizer().optimize(tree)) == expected, script
+
+def test_script_vm():
+    check_backend('vm', lambda script, tree: run_compiled(tree, 'vm'))
+
+def run_flat(tree):
+    variables = {}
+    flat = FlatAST.from_tree(tree)
+    return capture(lambda: flat.evaluate(variables), variables)
+
+def test_flat_ast():
+    check_backend('flat', lambda script, tree: run_flat(tree))
+
+    # 序列化之后再读回来，得到同样的AST
+    for script in BACKEND_SCRIPTS + ["", "int a;"]:
+        tree = SimpleParser().parse(script)
+        data = FlatAST.from_tree(tree).to_bytes()
+        flat = FlatAST.from_bytes(data)
+        assert flat.to_bytes() == data
+        assert flatten_AST(flat.to_tree()) == flatten_AST(tree), script
+
+    # 截断的数据报错
+    try:
+        FlatAST.from_bytes(data[:-1])
+        assert False
+    except Exception as e:
+        assert 'truncated' in str(e), e
+
+def test_incremental_parser():
+    # 每次修改之后的AST和完整地重新解析相同
+    parser = IncrementalParser()
+    state = parser.parse("int a = 1; int b = a + 2; b * 3; a = b;")
+    edits = [                       # 把第一处old换成new
+        ("= 1;", "= 10;"),          # 修改一个语句中的字面量
+        ("", "int c = 5; "),        # 在开头插入一个语句
+        ("a = b;", "a = b; c + a;"), # 在末尾插入
+        ("b * 3; ", ""),            # 删掉一个语句
+        ("int b", "int\nb"),
+    ]
+    for old, new in edits:
+        state = parser.edit(state, state.source.index(old), len(old), new)
+        assert flatten_AST(state.root) == flatten_AST(SimpleParser().parse(state.source)), state.source
+    assert state.reused_statements > 0
+
+    # 修改出语法错误时，报错和完整解析相同
+    try:
+        parser.edit(state, 0, 0, "int = ")
+        assert False
+    except Exception as e:
+        try:
+            SimpleParser().parse("int = " + state.source)
+            assert False
+        except Exception as full:
+            assert str(e) == str(full)
+
+def run_reactive(tree):
+    reactive = ReactiveScript()
+    output, variables, error = capture(lambda: reactive.update(tree, True), {})
+    return output, reactive.variables, error
+
+def test_reactive_script():
+    check_backend('reactive', lambda script, tree: run_reactive(tree))
+
+    # 使用了未声明的变量时一个语句也不执行，上一次的结果不会留下来
+    reactive = ReactiveScript({'x': 1})
+    reactive.update(SimpleParser().parse("int a = x + 1; a * 2;"))
+    try:
+        reactive.update(SimpleParser().parse("int a = x + 1; a * 2; b;"))
+        assert False
+    except Exception as e:
+        assert str(e) == 'unknown variable: b'
+    assert (reactive.variables, reactive.results, reactive.executed, reactive.skipped) == ({'x': 1}, [], 0, 0)
+
+def test_script_server():
+    # 每个会话有自己的变量表，没有以分号结尾的行等待后续的行
+    server = ScriptServer()
+    first = Session()
+    second = Session()
+    assert server.execute(first, 'int a = 1;')['output'] == 'a: 1\n'
+    assert server.execute(first, 'a +') == {'pending': True}
+    assert server.execute(first, '2;')['output'] == '3\n'
+    assert server.execute(second, 'a;')['error'] == 'unknown variable: a'
+    assert server.execute(second, 'exit();') == {'bye': True}
+
+    # 通过Unix套接字的完整请求和回复
+    async def session(path):
+        unix_server = await server.start(unix=path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        responses = []
+        for line in ['int b = 6;', 'b * 7;', 'c;', 'exit();']:
+            writer.write((line + '\n').encode('utf-8'))
+            await writer.drain()
+            responses.append(json.loads(await reader.readline()))
+        writer.close()
+        unix_server.close()
+        await unix_server.wait_closed()
+        return responses
+    directory = tempfile.mkdtemp()
+    try:
+        responses = asyncio.run(session(os.path.join(directory, 'pwc.sock')))
+    finally:
+        shutil.rmtree(directory)
+    assert [response.get('output') for response in responses[:2]] == ['b: 6\n', '42\n']
+    assert responses[2]['error'] == 'unknown variable: c'
+    assert responses[3] == {'bye': True}
+
+def test_script_cache():
+    directory = tempfile.mkdtemp()
+    try:
+        script = BACKEND_SCRIPTS[0]
+        expected = flatten_AST(SimpleParser().parse(script))
+        cache = ScriptCache(directory)
+        assert flatten_AST(cache.parse(script)) == expected
+        assert flatten_AST(ScriptCache(directory).parse(script)) == expected # 新的实例从文件读取
+        assert (cache.hits, cache.misses, cache.writes) == (0, 1, 1)
+
+        # 被截断、被修改的文件当作没有命中，删掉后重新写入
+        path = cache.path(script)
+        with open(path, 'rb') as file:
+            data = file.read()
+        for damaged in [data[:len(data) // 2], data[:20] + bytes([data[20] ^ 1]) + data[21:], b'']:
+            with open(path, 'wb') as file:
+                file.write(damaged)
+            assert flatten_AST(cache.parse(script)) == expected
+            with open(path, 'rb') as file:
+                assert file.read() == data
+        assert cache.errors == 3
+
+        cache.optimize = True # 优化过的AST用不同的键
+        assert cache.path(script) != path
+
+        # 不同的解析器、不同文法的LL1Parser用不同的键
+        paths = set(ScriptCache(directory, parser=parser).path(script) for parser in
+                    [SimpleParser(), PrecedenceParser(), LL1Parser(), LL1Parser(CALCULATOR_GRAMMAR)])
+        assert len(paths) == 4 and path in paths
+        relational = RELATIONAL_SCRIPTS[0]
+        assert flatten_AST(ScriptCache(directory, parser=PrecedenceParser()).parse(relational)) == \
+               flatten_AST(PrecedenceParser().parse(relational))
+        try:
+            ScriptCache(directory).parse(relational) # 不会读到PrecedenceParser的缓存
+            assert False
+        except Exception as e:
+            assert str(e) == 'unknown statement', e
+    finally:
+        shutil.rmtree(directory)
+
+def test_precedence_parser():
+    check_backend('precedence', lambda script, tree: evaluate_tree(PrecedenceParser().parse(script)))
 
 if __name__ == '__main__':
     #test_simple_lexer()
+    test_table_lexer()
     #test_simple_calculator()
-    test_simple_parser()
\ No newline at end of file
+    test_simple_parser()
+    test_crlf_file()
+    test_shared_tree()
+    test_script_compiler()
+    test_ast_optimizer()
+    test_script_vm()
+    test_flat_ast()
+    test_incremental_parser()
+    test_reactive_script()
+    test_script_server()
+    test_script_cache()
+    test_precedence_parser()
+    test_ll1_parser()